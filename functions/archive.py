@@ -0,0 +1,159 @@
+# Lazy reader for folders full of .fff files written by FLIR.shootFFF(), also
+# in the date and hour subfolders of a WriteBehindSink.
+# Files are memory-mapped instead of read, and the record offsets of every file
+# are indexed once and kept in a small sidecar file in the folder. Frames are
+# NumPy views on the mapped sensor data, so only the pages of the frames and
+# regions that are actually used are ever read from disk.
+#
+#   archive = FFFArchive('logs')
+#   T = archive.temperature(-1, (slice(100, 140), slice(150, 200)))
+#   for frame in archive: ...
+
+import glob, json, mmap, os
+from collections import OrderedDict
+
+import numpy as np
+
+from functions import fff
+
+INDEX_FILE = '.fffindex.json'
+
+class FFFArchive(object):
+    # source is a folder, searched with its subfolders, or a list of files.
+    # At most maxOpen files are kept mapped at the same time
+    def __init__(self, source, pattern='*.fff', maxOpen=64):
+        if isinstance(source, str):
+            self.folder = source
+            # By file name, which starts with the capture time, whatever the folder
+            self.paths = sorted(glob.glob(os.path.join(source, '**', pattern), recursive=True), key=os.path.basename)
+        else:
+            self.folder = None
+            self.paths = list(source)
+        self.maxOpen = maxOpen
+        self.maps = OrderedDict()
+        self.infos = {}
+        self.index = {}
+        self.dirty = False
+        self.loadIndex()
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, i):
+        return self.frame(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.frame(i)
+
+    # Read the sidecar index, keeping the entries of files that did not change
+    def loadIndex(self):
+        if self.folder is None:
+            return
+        try:
+            with open(os.path.join(self.folder, INDEX_FILE)) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        for path in self.paths:
+            entry = saved.get(self.key(path))
+            if entry is not None and entry['stamp'] == self.stamp(path):
+                self.index[path] = entry
+
+    # Write the sidecar index if new files were indexed
+    def saveIndex(self):
+        if self.folder is None or not self.dirty:
+            return
+        entries = dict((self.key(p), e) for p, e in self.index.items())
+        tmp = os.path.join(self.folder, INDEX_FILE + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp, os.path.join(self.folder, INDEX_FILE))
+        self.dirty = False
+
+    # Name of a file in the index: its path below the folder
+    def key(self, path):
+        return os.path.relpath(path, self.folder)
+
+    def stamp(self, path):
+        st = os.stat(path)
+        return [st.st_size, st.st_mtime_ns]
+
+    # Index all files now instead of on first access, and save the index
+    def buildIndex(self):
+        for i in range(len(self)):
+            self.entry(i)
+        self.saveIndex()
+
+    # Memory map of file i. Maps that were not used for a while are dropped;
+    # the OS closes them once no frame view refers to them anymore
+    def map(self, i):
+        path = self.paths[i]
+        m = self.maps.get(path)
+        if m is None:
+            with open(path, 'rb') as f:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[path] = m
+            while len(self.maps) > self.maxOpen:
+                self.maps.popitem(last=False)
+        else:
+            self.maps.move_to_end(path)
+        return m
+
+    # Record offsets of file i, from the index or parsed once
+    def entry(self, i):
+        path = self.paths[i]
+        entry = self.index.get(path)
+        if entry is None:
+            m = self.map(i)
+            records = fff.directory(m)
+            if fff.RAW_DATA not in records or fff.CAMERA_INFO not in records:
+                raise fff.FFFError(path + ": raw data or camera info record missing")
+            order, width, height, start, size = fff.rawLayout(m, *records[fff.RAW_DATA])
+            entry = {
+                'stamp': self.stamp(path),
+                'raw': records[fff.RAW_DATA],
+                'info': records[fff.CAMERA_INFO],
+                'order': order,
+                'shape': [height, width],
+                'start': start,
+                'png': m[start:start + 4] == b'\x89PNG',
+            }
+            self.index[path] = entry
+            self.dirty = True
+        return entry
+
+    # Raw sensor values of frame i, or of the region roi of it, as a view on
+    # the mapped file. PNG-compressed frames are decoded instead
+    def raw(self, i, roi=None):
+        entry = self.entry(i)
+        m = self.map(i)
+        if entry['png']:
+            raw = fff.rawImage(m, *entry['raw'])
+        else:
+            height, width = entry['shape']
+            raw = np.frombuffer(m, dtype=entry['order'] + 'u2', count=width * height, offset=entry['start']).reshape(height, width)
+        return raw if roi is None else raw[roi]
+
+    # Calibration constants of frame i, parsed on first use
+    def info(self, i):
+        path = self.paths[i]
+        if path not in self.infos:
+            self.infos[path] = fff.cameraInfo(self.map(i), *self.entry(i)['info'])
+        return self.infos[path]
+
+    def frame(self, i):
+        return fff.Frame(self.raw(i), self.info(i))
+
+    # Temperatures [°C] of frame i, decoding only roi if given
+    def temperature(self, i, roi=None, dtype=np.float32, **override):
+        return fff.temperature(self.raw(i, roi), self.info(i), dtype, **override)
+
+    # Raw values of roi for several frames, as one (frames, height, width) array
+    def stack(self, indices, roi=None):
+        return np.stack([self.raw(i, roi) for i in indices])
+
+    def close(self):
+        self.saveIndex()
+        self.maps.clear()
+        self.infos.clear()
@@ -0,0 +1,379 @@
+# asyncio counterpart of functions.flir.FLIR. Telnet and FTP run over asyncio
+# streams, so one event loop can drive many cameras and transfers at once.
+# Every call has a deadline; a call that is cancelled or times out in the middle
+# of a telnet command closes the session, because later replies could no longer
+# be matched to their commands. Call connect() again to continue.
+
+import asyncio, datetime, itertools, random, re, time
+
+from functions.flir import FLIRError, FLIRTimeout, FORMATS, deliver, parseReply, paramCommand
+
+import logging
+log = logging.getLogger('root')
+
+# Telnet protocol bytes, see RFC 854
+IAC, DONT, DO, WONT, WILL, SB, SE = 255, 254, 253, 252, 251, 250, 240
+
+# Run coro with a deadline, raising FLIRTimeout instead of asyncio.TimeoutError
+async def deadline(coro, timeout, what):
+    try:
+        return await asyncio.wait_for(coro, timeout)
+    except asyncio.TimeoutError:
+        raise FLIRTimeout(what + ": no answer within " + str(timeout) + " s")
+
+# Minimal asynchronous FTP client for the camera: passive mode, binary transfers
+class AsyncFTP(object):
+    def __init__(self, host, port=21, timeout=2):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        self.lock = None
+
+    async def connect(self):
+        self.lock = asyncio.Lock()
+        self.reader, self.writer = await deadline(asyncio.open_connection(self.host, self.port), self.timeout, "FTP connect")
+        await self.response('2')
+        await self.cmd('USER anonymous', '23')
+        if self.last.startswith('331'):
+            await self.cmd('PASS anonymous@', '2')
+        await self.cmd('TYPE I', '2')
+
+    # Read one (possibly multi-line) response and check its first digit(s)
+    async def response(self, expect):
+        line = (await deadline(self.reader.readline(), self.timeout, "FTP")).decode('latin-1')
+        if not line:
+            raise EOFError("FTP connection closed")
+        lines = [line]
+        if line[3:4] == '-':
+            while not (line[:3] == lines[0][:3] and line[3:4] == ' '):
+                line = (await deadline(self.reader.readline(), self.timeout, "FTP")).decode('latin-1')
+                if not line:
+                    raise EOFError("FTP connection closed")
+                lines.append(line)
+        self.last = ''.join(lines).strip()
+        if not any(self.last.startswith(e) for e in expect):
+            raise FLIRError("FTP: " + self.last)
+        return self.last
+
+    async def cmd(self, line, expect):
+        self.writer.write(line.encode('latin-1') + b'\r\n')
+        return await self.response(expect)
+
+    # Open a passive data connection
+    async def dataConnection(self):
+        reply = await self.cmd('PASV', '227')
+        numbers = re.search(r'(\d+),(\d+),(\d+),(\d+),(\d+),(\d+)', reply).groups()
+        host = '.'.join(numbers[:4])
+        port = int(numbers[4]) * 256 + int(numbers[5])
+        return await deadline(asyncio.open_connection(host, port), self.timeout, "FTP data connection")
+
+    async def noop(self):
+        async with self.lock:
+            await self.cmd('NOOP', '2')
+
+    async def size(self, remote):
+        async with self.lock:
+            try:
+                return int((await self.cmd('SIZE ' + remote, '213')).split()[1])
+            except FLIRError:
+                return 0
+
+    async def delete(self, remote):
+        async with self.lock:
+            await self.cmd('DELE ' + remote, '2')
+
+    async def nlst(self):
+        async with self.lock:
+            reader, writer = await self.dataConnection()
+            await self.cmd('NLST', '1')
+            data = await deadline(reader.read(), self.timeout, "FTP NLST")
+            writer.close()
+            await self.response('2')
+        return [n for n in data.decode('latin-1').splitlines() if n]
+
+    # Download remote into memory. The buffer is sized from SIZE and filled in place
+    async def retr(self, remote, size=None, timeout=None):
+        if size is None:
+            size = await self.size(remote)
+        async with self.lock:
+            buf = bytearray(size)
+            pos = 0
+            reader, writer = await self.dataConnection()
+            try:
+                await self.cmd('RETR ' + remote, '1')
+                while True:
+                    block = await deadline(reader.read(65536), timeout or self.timeout, "FTP RETR " + remote)
+                    if not block:
+                        break
+                    buf[pos:pos + len(block)] = block
+                    pos += len(block)
+            finally:
+                writer.close()
+            await self.response('2')
+        del buf[pos:]
+        return memoryview(buf)
+
+    # Close without QUIT, for a session in an unknown state
+    def abort(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    async def quit(self):
+        if self.writer is None:
+            return
+        try:
+            await self.cmd('QUIT', '2')
+        except (FLIRError, EOFError, OSError):
+            pass
+        self.writer.close()
+        self.writer = None
+
+class AsyncFLIR(object):
+    def __init__(self, host, port=23, ftpPort=21):
+        self.host = host
+        self.port = port
+        self.ftpPort = ftpPort
+        self.timeout = 2
+        self.prompt = b'>'
+        self.timeouts = {
+            'connect': 2,
+            'default': 1,
+            'store': 10,
+            'focus': 10,
+            'transfer': 10,
+        }
+        self.reader = None
+        self.writer = None
+        self.buffer = bytearray()
+        self.lock = None
+        self.ftp = None
+        self.shotNumbers = itertools.count(random.randrange(10000000))
+
+    async def connect(self):
+        self.lock = asyncio.Lock()
+        self.buffer = bytearray()
+        try:
+            self.reader, self.writer = await deadline(
+                asyncio.open_connection(self.host, self.port), self.timeouts['connect'], "FLIR.connect() " + self.host)
+        except FLIRTimeout:
+            log.info("AsyncFLIR.connect() timeout")
+            raise
+        # when connecting, just read until you reach the prompt
+        await self.expect(b'msc]', self.timeouts['connect'])
+        await self.expect(self.prompt, self.timeouts['connect'])
+
+    # Read from the telnet session into self.buffer, answering option
+    # negotiations with a refusal as telnetlib does
+    async def fill(self):
+        data = await self.reader.read(4096)
+        if not data:
+            raise EOFError("telnet connection closed")
+        i = 0
+        while i < len(data):
+            c = data[i]
+            if c != IAC:
+                j = data.find(bytes([IAC]), i)
+                j = len(data) if j < 0 else j
+                self.buffer += data[i:j]
+                i = j
+            elif i + 1 < len(data) and data[i + 1] in (DO, DONT, WILL, WONT):
+                if i + 2 >= len(data):
+                    data += await self.reader.readexactly(1)
+                verb, option = data[i + 1], data[i + 2]
+                if verb in (DO, DONT):
+                    self.writer.write(bytes([IAC, WONT, option]))
+                else:
+                    self.writer.write(bytes([IAC, DONT, option]))
+                i += 3
+            elif i + 1 < len(data) and data[i + 1] == SB:
+                end = data.find(bytes([IAC, SE]), i)
+                while end < 0:
+                    data += await self.reader.read(4096)
+                    end = data.find(bytes([IAC, SE]), i)
+                i = end + 2
+            elif i + 1 < len(data) and data[i + 1] == IAC:
+                self.buffer.append(IAC)
+                i += 2
+            else:
+                if i + 1 >= len(data):
+                    data += await self.reader.readexactly(1)
+                i += 2
+
+    async def readUntil(self, token):
+        while True:
+            end = self.buffer.find(token)
+            if end >= 0:
+                end += len(token)
+                reply = bytes(self.buffer[:end])
+                del self.buffer[:end]
+                return reply
+            await self.fill()
+
+    # Wait until the camera sends the expected token, or raise FLIRTimeout
+    async def expect(self, token=None, timeout=None):
+        token = token or self.prompt
+        timeout = timeout or self.timeouts['default']
+        try:
+            reply = await deadline(self.readUntil(token), timeout, "expected " + repr(token))
+        except BaseException:
+            # A reply is still on its way; the session can no longer be used
+            self.abort()
+            raise
+        return reply.decode('ascii', 'replace')
+
+    # Drop the telnet session
+    def abort(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    async def command(self, cmd, kind='default', expect=None):
+        if isinstance(cmd, str):
+            cmd = cmd.encode('ascii')
+        if self.writer is None:
+            raise FLIRError("not connected")
+        async with self.lock:
+            self.writer.write(cmd + b'\n')
+            reply = await self.expect(expect, self.timeouts.get(kind, self.timeouts['default']))
+        return parseReply(cmd, reply, expect or self.prompt)
+
+    # Send several commands in one write, see FLIR.pipeline()
+    async def pipeline(self, cmds, kind='default'):
+        cmds = [c.encode('ascii') if isinstance(c, str) else c for c in cmds]
+        if not cmds:
+            return []
+        if self.writer is None:
+            raise FLIRError("not connected")
+        timeout = self.timeouts.get(kind, self.timeouts['default'])
+        replies = []
+        async with self.lock:
+            self.writer.write(b''.join(c + b'\n' for c in cmds))
+            for cmd in cmds:
+                reply = await self.expect(self.prompt, timeout)
+                try:
+                    replies.append(parseReply(cmd, reply, self.prompt))
+                except FLIRError as e:
+                    replies.append(e)
+        return replies
+
+    # Set camera date and time to the computer time
+    async def setDateTime(self):
+        now = datetime.datetime.now()
+        await self.command(b'date', expect=b'Enter new date (mm/dd/yyyy): ')
+        await self.command(now.strftime('%m/%d/%Y'))
+        await self.command(b'time', expect=b'Enter new time: ')
+        await self.command(datetime.datetime.now().strftime('%H:%M:%S'))
+
+    # Set several parameters in a single round trip, see FLIR.applyParams()
+    async def applyParams(self, **params):
+        names = list(params)
+        replies = await self.pipeline([paramCommand(n, params[n]) for n in names])
+        return dict((n, r if isinstance(r, FLIRError) else None) for n, r in zip(names, replies))
+
+    async def setRH(self, rh):
+        await self.command(paramCommand('rh', rh))
+
+    async def setDist(self, distance):
+        await self.command(paramCommand('dist', distance))
+
+    async def setAmbT(self, T):
+        await self.command(paramCommand('ambT', T))
+
+    async def setAtmT(self, T):
+        await self.command(paramCommand('atmT', T))
+
+    async def setEmiss(self, E):
+        await self.command(paramCommand('emiss', E))
+
+    async def setPal(self, pal):
+        await self.command(paramCommand('pal', pal))
+
+    async def quickFocus(self):
+        await self.command(paramCommand('autofast', True), 'focus')
+
+    async def slowFocus(self):
+        await self.command(paramCommand('autofull', True), 'focus')
+
+    # FTP session for the transfers, opened on first use
+    async def ftpSession(self):
+        if self.ftp is None or self.ftp.writer is None:
+            self.ftp = AsyncFTP(self.host, self.ftpPort, self.timeout)
+            try:
+                await self.ftp.connect()
+            except BaseException:
+                self.ftp = None
+                raise
+        return self.ftp
+
+    # Unique name for a new file on the camera, see FLIR.remoteName()
+    def remoteName(self, fmt):
+        return 'f%07d' % (next(self.shotNumbers) % 10000000) + FORMATS[fmt][1]
+
+    # Store an image on the camera. Returns the metadata of the shot
+    async def store(self, fmt='jpg', remote=None):
+        if remote is None:
+            remote = self.remoteName(fmt)
+        meta = {'format': fmt, 'remote': remote, 'time': datetime.datetime.now()}
+        start = time.perf_counter()
+        await self.command(FORMATS[fmt][0] + remote.encode('ascii'), 'store')
+        meta['storeTime'] = time.perf_counter() - start
+        return meta
+
+    # Download a stored image into memory
+    async def fetch(self, remote):
+        ftp = await self.ftpSession()
+        try:
+            return await ftp.retr(remote, timeout=self.timeouts['transfer'])
+        except FLIRTimeout:
+            # FLIRTimeout is an OSError too, but the session is still busy
+            # with the transfer: drop it without waiting for an answer to QUIT
+            self.ftp = None
+            ftp.abort()
+            raise
+        except (EOFError, OSError):
+            # The server dropped the session, close it and retry once on a new one
+            self.ftp = None
+            ftp.abort()
+            ftp = await self.ftpSession()
+            return await ftp.retr(remote, timeout=self.timeouts['transfer'])
+        except BaseException:
+            # The session state is unknown after a cancellation
+            await self.ftpClose()
+            raise
+
+    async def delete(self, remote):
+        await self.command(b'del ' + remote.encode('ascii'))
+
+    # Shoot an image and return its content, see FLIR.capture()
+    async def capture(self, fmt='jpg', sink=None, remote=None):
+        meta = await self.store(fmt, remote)
+        remote = meta['remote']
+        start = time.perf_counter()
+        data = await self.fetch(remote)
+        meta['transferTime'] = time.perf_counter() - start
+        meta['size'] = len(data)
+        await self.delete(remote)
+        if sink is not None:
+            meta['stored'] = deliver(sink, data, meta)
+        return data, meta
+
+    async def ftpClose(self):
+        if self.ftp is not None:
+            ftp, self.ftp = self.ftp, None
+            try:
+                await ftp.quit()
+            except (FLIRError, EOFError, OSError):
+                pass
+
+    async def close(self):
+        await self.ftpClose()
+        if self.writer is not None:
+            self.writer.write(b'exit\n')
+            try:
+                await self.writer.drain()
+            except OSError:
+                pass
+            self.abort()
@@ -0,0 +1,155 @@
+# Throughput benchmarks of the capture code against local simulators
+# (functions.simulator), so that a slowdown is noticed before it reaches a
+# camera in the field:
+#   capture   frames/minute of sequential FLIR.capture()
+#   stream    frames/minute of FLIR.stream(), store overlapped with transfer
+#   commands  latency percentiles of rset, applyParams and store
+#   fleet     frames/minute of Fleet.shoot() with 1, 4 and 16 cameras
+#
+#   python -m functions.benchmark --frames 20 --min-fpm 120 --json bench.json
+#
+# The exit code is 1 when the stream rate is below --min-fpm.
+
+import argparse, asyncio, json, sys, time
+
+from functions.simulator import Simulator
+
+import logging
+log = logging.getLogger('root')
+
+# Percentiles [ms] of a list of durations [s]
+def percentiles(values, points=(50, 90, 99)):
+    values = sorted(values)
+    result = {}
+    for p in points:
+        pos = (len(values) - 1) * p / 100.0
+        below = int(pos)
+        above = min(below + 1, len(values) - 1)
+        result['p%g' % p] = 1000 * (values[below] + (values[above] - values[below]) * (pos - below))
+    result['max'] = 1000 * values[-1]
+    return result
+
+def benchCapture(sim, fmt, frames):
+    cam = sim.camera()
+    try:
+        start = time.perf_counter()
+        for n in range(frames):
+            cam.capture(fmt)
+        elapsed = time.perf_counter() - start
+    finally:
+        cam.close()
+    return {'frames': frames, 'seconds': elapsed, 'fpm': 60 * frames / elapsed}
+
+def benchStream(sim, fmt, frames):
+    cam = sim.camera()
+    try:
+        start = time.perf_counter()
+        for data, meta in cam.stream(fmt, frames):
+            pass
+        elapsed = time.perf_counter() - start
+    finally:
+        cam.close()
+    return {'frames': frames, 'seconds': elapsed, 'fpm': 60 * frames / elapsed, 'metrics': cam.metricsSnapshot()}
+
+def benchCommands(sim, fmt, repeat):
+    cam = sim.camera()
+    timings = {'rset': [], 'applyParams': [], 'store': []}
+    try:
+        for n in range(repeat):
+            # Empty the state cache, or the unchanged values would not be sent
+            cam.invalidate()
+            start = time.perf_counter()
+            cam.setRH(0.5)
+            timings['rset'].append(time.perf_counter() - start)
+            cam.invalidate()
+            start = time.perf_counter()
+            cam.applyParams(rh=0.5, dist=1.0, ambT=20, atmT=20, emiss=0.95)
+            timings['applyParams'].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            meta = cam.store(fmt)
+            timings['store'].append(time.perf_counter() - start)
+            cam.deleteFiles([meta['remote']])
+    finally:
+        cam.close()
+    return dict((name, percentiles(values)) for name, values in timings.items())
+
+async def shootFleet(sims, fmt, frames):
+    from functions.fleet import Fleet
+    fleet = Fleet([s.asyncCamera() for s in sims], fmt=fmt)
+    try:
+        await fleet.connect()
+        skews = []
+        failed = 0
+        start = time.perf_counter()
+        for n in range(frames):
+            report = await fleet.shoot()
+            skews.append(report['skew'])
+            failed += sum(1 for r in report['cameras'].values() if 'error' in r)
+        elapsed = time.perf_counter() - start
+    finally:
+        await fleet.close()
+    good = frames * len(sims) - failed
+    return {'cameras': len(sims), 'frames': good, 'failed': failed, 'seconds': elapsed,
+            'fpm': 60 * good / elapsed, 'skew': percentiles(skews)}
+
+def benchFleet(fmt, frames, sizes, latency):
+    results = []
+    for size in sizes:
+        sims = [Simulator(latency=latency).start() for i in range(size)]
+        try:
+            results.append(asyncio.run(shootFleet(sims, fmt, frames)))
+        finally:
+            for sim in sims:
+                sim.stop()
+    return results
+
+def run(fmt='jpg', frames=20, latency=None, fleet=(1, 4, 16)):
+    sim = Simulator(latency=latency).start()
+    try:
+        results = {
+            'format': fmt,
+            'latency': sim.state.latency,
+            'capture': benchCapture(sim, fmt, frames),
+            'stream': benchStream(sim, fmt, frames),
+            'commands': benchCommands(sim, fmt, frames),
+        }
+    finally:
+        sim.stop()
+    if fleet:
+        results['fleet'] = benchFleet(fmt, max(frames // 4, 1), fleet, latency)
+    return results
+
+def printResults(results):
+    log.info("capture  %7.1f frames/min" % results['capture']['fpm'])
+    log.info("stream   %7.1f frames/min" % results['stream']['fpm'])
+    for name, p in sorted(results['commands'].items()):
+        log.info("%-12s p50 %7.2f ms, p90 %7.2f ms, p99 %7.2f ms, max %7.2f ms" % (name, p['p50'], p['p90'], p['p99'], p['max']))
+    for r in results.get('fleet', []):
+        log.info("fleet %3d cameras %7.1f frames/min, %d failed, skew p90 %.2f ms" % (
+            r['cameras'], r['fpm'], r['failed'], r['skew']['p90']))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Capture throughput benchmarks against simulated cameras")
+    parser.add_argument('--format', choices=['jpg', 'fff'], default='jpg')
+    parser.add_argument('--frames', type=int, default=20, help="frames per benchmark")
+    parser.add_argument('--store', type=float, default=None, help="simulated store latency [s]")
+    parser.add_argument('--bandwidth', type=float, default=None, help="simulated FTP rate [bytes/s]")
+    parser.add_argument('--fleet', default='1,4,16', help="fleet sizes, comma separated, empty to skip")
+    parser.add_argument('--min-fpm', type=float, default=None, help="fail if the stream rate is below this")
+    parser.add_argument('--json', help="write the results to this file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)8s %(module)15s: %(message)s')
+    latency = {}
+    if args.store is not None:
+        latency['store'] = latency['storeJpg'] = args.store
+    if args.bandwidth is not None:
+        latency['bandwidth'] = args.bandwidth
+    sizes = [int(s) for s in args.fleet.split(',') if s]
+    results = run(args.format, args.frames, latency, sizes)
+    printResults(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.min_fpm is not None and results['stream']['fpm'] < args.min_fpm:
+        log.error("stream rate %.1f frames/min is below %.1f" % (results['stream']['fpm'], args.min_fpm))
+        sys.exit(1)
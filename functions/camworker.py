@@ -0,0 +1,72 @@
+# Runs the FLIR calls of the GUI in their own thread, so that the window stays
+# responsive while the camera is busy. Commands arrive through the queued
+# signal connection to run() and are executed in order; the results are sent
+# back with the finished and failed signals. The connection is watched by a
+# Supervisor, which probes it and reconnects after a drop; the changes are
+# reported with the connection signal.
+
+import ftplib
+
+from PyQt5 import QtCore
+
+import functions.flir
+from functions.flir import FLIRError
+from functions.resources import ResourceError
+from functions.supervisor import Supervisor
+
+import logging
+log = logging.getLogger('root')
+
+class CameraWorker(QtCore.QObject):
+    finished = QtCore.pyqtSignal(str, object) # command, result
+    failed = QtCore.pyqtSignal(str, str)      # command, error message
+    connection = QtCore.pyqtSignal(bool, str) # online, message
+
+    def __init__(self, parent=None, tickInterval=1000):
+        QtCore.QObject.__init__(self, parent)
+        self.supervisor = None
+        self.tickInterval = tickInterval # [ms] between the checks of the supervisor
+        self.timer = None
+
+    # Execute one command. name is a FLIR method, or 'connect'/'close' which
+    # also create and drop the camera object
+    @QtCore.pyqtSlot(str, object)
+    def run(self, name, args):
+        try:
+            result = self.execute(name, args)
+        except (FLIRError, ResourceError, EOFError) + ftplib.all_errors as e:
+            log.info(name + " failed: " + str(e))
+            self.failed.emit(name, str(e))
+        else:
+            self.finished.emit(name, result)
+
+    def execute(self, name, args):
+        if name == 'connect':
+            if self.supervisor is not None:
+                self.supervisor.close()
+            supervisor = Supervisor(functions.flir.FLIR(*args))
+            try:
+                supervisor.connect()
+            except Exception:
+                supervisor.drop()
+                raise
+            supervisor.onChange = self.connection.emit
+            self.supervisor = supervisor
+            # The timer belongs to this thread, so it is created here and not in __init__
+            if self.timer is None:
+                self.timer = QtCore.QTimer()
+                self.timer.timeout.connect(self.tick)
+            self.timer.start(self.tickInterval)
+            return None
+        if self.supervisor is None:
+            raise FLIRError("not connected")
+        if name == 'close':
+            self.timer.stop()
+            supervisor, self.supervisor = self.supervisor, None
+            return supervisor.close()
+        return self.supervisor.call(name, *args)
+
+    @QtCore.pyqtSlot()
+    def tick(self):
+        if self.supervisor is not None:
+            self.supervisor.tick()
@@ -0,0 +1,114 @@
+# Convert a capture folder to temperature arrays, without the GUI.
+# Every .fff file, and every radiometric .jpg file, below the folder becomes a
+# .npz (compressed) or .npy (memory-mappable float32) file with the same
+# relative path in the output folder. Files that are already converted and not
+# older than their source are skipped, so the command can be re-run on a
+# growing folder. The work is spread over one process per CPU.
+#
+#   python -m functions.convert logs --out converted --csv summary.csv
+
+import argparse, csv, os, sys, time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from functions import fff
+
+import logging
+log = logging.getLogger('root')
+
+EXTENSIONS = ('.fff', '.jpg', '.jpeg')
+
+# Source files below folder with their output file names
+def jobs(folder, out, fmt):
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() not in EXTENSIONS:
+                continue
+            source = os.path.join(root, name)
+            target = os.path.join(out, os.path.relpath(source, folder))
+            yield source, os.path.splitext(target)[0] + '.' + fmt
+
+def upToDate(source, target):
+    try:
+        return os.stat(target).st_mtime >= os.stat(source).st_mtime
+    except OSError:
+        return False
+
+# Convert one file. Returns (source, status, summary). An error only fails
+# its own file, whatever it is (damaged records, zlib errors in compressed
+# raw data, a full disk), so the rest of the batch is still converted
+def convertFile(job):
+    source, target = job
+    try:
+        return source, 'converted', writeTemperature(source, target)
+    except Exception as e:
+        return source, 'failed: %s: %s' % (type(e).__name__, e), None
+
+# Write the temperatures of source to target. Returns the summary row
+def writeTemperature(source, target):
+    frame = fff.load(source)
+    T = frame.temperature()
+    os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+    # Write to a temporary name first, so that an interrupted run never leaves
+    # a truncated file that later runs would consider up to date
+    tmp = target + '.part'
+    try:
+        with open(tmp, 'wb') as f:
+            if target.endswith('.npz'):
+                stamp = frame.time.isoformat() if frame.time else ''
+                np.savez_compressed(f, temperature=T, raw=frame.raw, time=stamp)
+            else:
+                np.save(f, T)
+        os.replace(tmp, target)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return [source, frame.time.isoformat() if frame.time else '',
+            '%.3f' % T.min(), '%.3f' % T.max(), '%.3f' % T.mean()]
+
+def convert(folder, out, fmt='npz', summary=None, workers=None, force=False):
+    todo = [j for j in jobs(folder, out, fmt) if force or not upToDate(*j)]
+    log.info("%d file(s) to convert" % len(todo))
+    writer = None
+    if summary is not None:
+        exists = os.path.exists(summary)
+        summaryFile = open(summary, 'a', newline='')
+        writer = csv.writer(summaryFile)
+        if not exists:
+            writer.writerow(['file', 'time', 'min', 'max', 'mean'])
+    start = time.perf_counter()
+    converted = failed = 0
+    try:
+        with ProcessPoolExecutor(workers or os.cpu_count()) as pool:
+            for source, status, row in pool.map(convertFile, todo, chunksize=8):
+                if row is None:
+                    failed += 1
+                    log.warning(source + ": " + status)
+                    continue
+                converted += 1
+                if writer is not None:
+                    writer.writerow(row)
+    finally:
+        if writer is not None:
+            summaryFile.close()
+    elapsed = time.perf_counter() - start
+    log.info("%d converted, %d failed in %.1f s (%.1f files/s)" % (
+        converted, failed, elapsed, converted / elapsed if elapsed else 0))
+    return converted, failed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert captured .fff/.jpg files to temperature arrays [°C]")
+    parser.add_argument('folder', help="capture folder, searched recursively")
+    parser.add_argument('--out', help="output folder, default: next to the source files")
+    parser.add_argument('--format', choices=['npz', 'npy'], default='npz',
+                        help="npz: compressed, with raw values and time; npy: float32 array that can be memory-mapped")
+    parser.add_argument('--csv', help="append min/max/mean per file to this CSV file")
+    parser.add_argument('--workers', type=int, default=None, help="processes, default: number of CPUs")
+    parser.add_argument('--force', action='store_true', help="convert files that are already converted")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)8s %(module)15s: %(message)s')
+    converted, failed = convert(args.folder, args.out or args.folder, args.format, args.csv, args.workers, args.force)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,324 @@
+# Headless capture service for unattended Linux PCs. The cameras, intervals,
+# object parameters and output are read from an INI file; every camera runs in
+# its own thread, supervised and reconnected after drops. SIGHUP reloads the
+# file (cameras whose address, format or output did not change keep running
+# and only take over the new interval and parameters), SIGTERM and Ctrl+C
+# write what is queued and stop.
+#
+# Only the modules a configuration needs are imported: no Qt at all, and NumPy
+# only for the framestore and roi outputs or the change gate, so the service is
+# up in a fraction of a second and a watchdog restart is cheap.
+#
+#   python -m functions.daemon flir.ini
+#   python -m functions.daemon flir.ini --check     # only validate the file
+#
+# Example configuration, [DEFAULT] applies to every camera:
+#
+#   [DEFAULT]
+#   out = /var/lib/flir
+#   interval = 60
+#   format = jpg
+#   sink = files                  ; files, framestore or roi
+#   changeThreshold = 0.5         ; [°C], optional, drop unchanged frames
+#   jpegThreshold = 8             ; [grey levels], the same for JPEG without temperatures
+#   emiss = 0.95
+#
+#   [daemon]
+#   metrics = /var/lib/node_exporter  ; optional, Prometheus text files
+#
+#   [camera roof]
+#   host = 192.168.1.10
+#   atmT = 12
+#   focus = full                  ; none, quick or full, after connecting
+
+import argparse, configparser, ftplib, os, signal, sys, threading, time
+
+from functions.flir import FLIR, FLIRError, FORMATS
+from functions.resources import RESOURCES, ResourceError
+from functions.scheduler import DeadlineScheduler
+from functions.supervisor import Supervisor
+from functions.writer import WriteBehindSink
+
+import logging
+log = logging.getLogger('root')
+
+# Frame size of the A320 [pixels], for the outputs that need it up front
+SHAPE = (240, 320)
+SINKS = ('files', 'framestore', 'roi')
+FOCUS = ('none', 'quick', 'full')
+# Settings a running camera takes over on reload, any other change restarts it
+LIVE = ('interval', 'params')
+# Shortest time [s] between the start of a camera thread and its restart after
+# it died, so that a camera whose output cannot be opened is not retried in a loop
+RESTART_DELAY = 30
+# Object parameters by their name in the configuration file, where keys are lower case
+PARAMS = dict((name.lower(), name) for name, r in RESOURCES.items() if r.setter)
+
+class ConfigError(ValueError):
+    pass
+
+def cameraConfig(name, section):
+    try:
+        config = {
+            'name': name,
+            'host': section.get('host'),
+            'port': section.getint('port', 23),
+            'ftpPort': section.getint('ftpport', 21),
+            'format': section.get('format', 'jpg'),
+            'interval': section.getfloat('interval', 60.0),
+            'align': section.getboolean('align', False),
+            'focus': section.get('focus', 'none'),
+            'out': section.get('out', '.'),
+            'sink': section.get('sink', 'files'),
+            'rois': section.get('rois'),
+            'changeThreshold': section.getfloat('changethreshold', None),
+            'jpegThreshold': section.getfloat('jpegthreshold', 8.0),
+            'keepEvery': section.getint('keepevery', 10),
+            'syncEvery': section.getint('syncevery', 16),
+            'params': {},
+        }
+        for key, param in PARAMS.items():
+            if key in section:
+                resource = RESOURCES[param]
+                value = section.get(key) if resource.kind == 'choice' else section.getfloat(key)
+                resource.encode(value) # checks type and range
+                config['params'][param] = value
+    except ValueError as e:
+        raise ConfigError("[camera " + name + "] " + str(e))
+    if not config['host']:
+        raise ConfigError("[camera " + name + "] needs a host")
+    if config['format'] not in FORMATS or config['sink'] not in SINKS or config['focus'] not in FOCUS:
+        raise ConfigError("[camera %s] format must be one of %s, sink one of %s, focus one of %s" % (
+            name, ', '.join(FORMATS), ', '.join(SINKS), ', '.join(FOCUS)))
+    if config['interval'] <= 0:
+        raise ConfigError("[camera " + name + "] interval must be positive")
+    if config['sink'] == 'roi' and not config['rois']:
+        raise ConfigError("[camera " + name + "] the roi output needs rois = <JSON file>")
+    return config
+
+# {'metrics': folder or None, 'cameras': [camera config, ...]}
+def loadConfig(path):
+    parser = configparser.ConfigParser(interpolation=None)
+    try:
+        if not parser.read(path):
+            raise ConfigError("cannot read " + path)
+    except configparser.Error as e:
+        raise ConfigError(str(e))
+    cameras = [cameraConfig(s.split(None, 1)[1], parser[s]) for s in parser.sections() if s.startswith('camera ')]
+    if not cameras:
+        raise ConfigError(path + " defines no [camera <name>] section")
+    daemon = parser['daemon'] if parser.has_section('daemon') else parser[parser.default_section]
+    return {'metrics': daemon.get('metrics'), 'cameras': cameras}
+
+# Output of a camera, the modules that need NumPy are only imported here
+def makeSink(config):
+    folder = os.path.join(config['out'], config['name'])
+    if config['sink'] == 'files':
+        sink = WriteBehindSink(folder, syncEvery=config['syncEvery'])
+    elif config['sink'] == 'framestore':
+        from functions.framestore import FrameStore, FrameStoreSink
+        os.makedirs(folder, exist_ok=True)
+        sink = FrameStoreSink(FrameStore(os.path.join(folder, config['name'] + '.frames'), SHAPE))
+    else:
+        from functions.roi import ROISet, ROIWriter, ROISink
+        os.makedirs(folder, exist_ok=True)
+        rois = ROISet.load(config['rois'], SHAPE)
+        sink = ROISink(rois, ROIWriter(os.path.join(folder, 'roi.csv'), rois))
+    if config['changeThreshold'] is not None:
+        from functions.gate import ChangeGate
+        sink = ChangeGate(sink, config['changeThreshold'], config['keepEvery'], jpegThreshold=config['jpegThreshold'])
+    return sink
+
+def closeSink(sink):
+    sink = getattr(sink, 'sink', sink) # behind a ChangeGate
+    if hasattr(sink, 'store'):
+        sink.store.close()
+    elif hasattr(sink, 'writer'):
+        sink.writer.close()
+    else:
+        sink.close()
+
+class CameraRunner(threading.Thread):
+    def __init__(self, config):
+        threading.Thread.__init__(self, name='camera ' + config['name'], daemon=True)
+        self.config = config
+        self.pending = None
+        self.stopping = threading.Event()
+        self.cam = FLIR(config['host'], config['port'], config['ftpPort'])
+        self.supervisor = Supervisor(self.cam)
+        # Applied at every (re)connect by the supervisor
+        self.supervisor.params = dict(config['params'])
+        self.scheduler = DeadlineScheduler(config['interval'], align=config['align'])
+        self.lost = 0
+
+    def needsRestart(self, config):
+        return any(config[k] != self.config[k] for k in config if k not in LIVE)
+
+    # Take over a new interval and parameters, from the camera thread
+    def reconfigure(self, config):
+        self.pending = config
+
+    def apply(self, config):
+        if config['interval'] != self.config['interval']:
+            log.info("%s: interval %g s" % (config['name'], config['interval']))
+            self.scheduler.setInterval(config['interval'])
+        changed = dict((n, v) for n, v in config['params'].items() if self.config['params'].get(n) != v)
+        self.supervisor.params.update(changed)
+        if changed and self.supervisor.online:
+            self.call('applyParams', **changed)
+        self.config = config
+
+    # Run a FLIR method through the supervisor. Errors of the output arrive as
+    # SinkError, a FLIRError, so a failing sink only loses its shot
+    def call(self, name, *args, **kwargs):
+        try:
+            return self.supervisor.call(name, *args, **kwargs)
+        except (FLIRError, ResourceError, EOFError) + ftplib.all_errors as e:
+            log.warning("%s: %s failed: %s" % (self.config['name'], name, e))
+            return None
+
+    def run(self):
+        try:
+            sink = makeSink(self.config)
+        except (ImportError, OSError, ValueError) as e:
+            log.error("%s: cannot open the output: %s" % (self.config['name'], e))
+            return
+        focused = False
+        try:
+            while not self.stopping.is_set():
+                if self.pending is not None:
+                    config, self.pending = self.pending, None
+                    self.apply(config)
+                online = self.supervisor.tick()
+                if online and not focused:
+                    focused = True
+                    if self.config['focus'] != 'none':
+                        self.call('quickFocus' if self.config['focus'] == 'quick' else 'slowFocus')
+                missed = self.scheduler.missed
+                slot = self.scheduler.due(busy=not online)
+                if self.scheduler.missed > missed and not online:
+                    self.lost += self.scheduler.missed - missed
+                    log.warning("%s: shot lost, camera offline" % self.config['name'])
+                if slot is not None:
+                    if self.call('capture', self.config['format'], sink) is None:
+                        self.lost += 1
+                self.stopping.wait(min(self.scheduler.delay(), 1.0))
+        except Exception:
+            # The daemon restarts the thread, see Daemon.restartDead()
+            log.exception("%s: camera thread failed" % self.config['name'])
+        finally:
+            self.supervisor.close()
+            closeSink(sink)
+            stats = self.scheduler.stats()
+            log.info("%s stopped: %d shots, %d missed, %d lost" % (self.config['name'], stats['fired'], stats['missed'], self.lost))
+
+    def stop(self):
+        self.stopping.set()
+
+class Daemon(object):
+    def __init__(self, path, metricsInterval=15):
+        self.path = path
+        self.metricsInterval = metricsInterval
+        self.runners = {}
+        self.config = None
+        self.stopping = threading.Event()
+        self.reloadRequested = False
+
+    def startRunner(self, config):
+        runner = CameraRunner(config)
+        self.runners[config['name']] = runner
+        runner.started = time.monotonic()
+        runner.start()
+        log.info("%s: capturing %s from %s every %g s" % (config['name'], config['format'], config['host'], config['interval']))
+
+    def stopRunner(self, name):
+        runner = self.runners.pop(name)
+        runner.stop()
+        runner.join()
+
+    def reload(self):
+        try:
+            config = loadConfig(self.path)
+        except ConfigError as e:
+            log.error("Reload failed, keeping the running configuration: " + str(e))
+            return
+        cameras = dict((c['name'], c) for c in config['cameras'])
+        for name in list(self.runners):
+            runner = self.runners[name]
+            if name not in cameras or runner.needsRestart(cameras[name]) or not runner.is_alive():
+                self.stopRunner(name)
+        for name, camera in cameras.items():
+            if name in self.runners:
+                self.runners[name].reconfigure(camera)
+            else:
+                self.startRunner(camera)
+        self.config = config
+        log.info("Configuration reloaded, %d camera(s)" % len(self.runners))
+
+    # Start the camera threads again that ended without being stopped
+    def restartDead(self):
+        for name, runner in list(self.runners.items()):
+            if not runner.is_alive() and not runner.stopping.is_set() and time.monotonic() - runner.started >= RESTART_DELAY:
+                log.error("%s: camera thread ended, restarting it" % name)
+                self.startRunner(runner.pending or runner.config)
+
+    # Prometheus text file per camera, for the textfile collector of node_exporter
+    def writeMetrics(self, runners):
+        folder = self.config['metrics']
+        for name, runner in runners.items():
+            filename = os.path.join(folder, 'flir_' + name + '.prom')
+            try:
+                with open(filename + '.part', 'w') as f:
+                    f.write(runner.cam.metrics.prometheus({'camera': name}))
+                os.replace(filename + '.part', filename)
+            except OSError as e:
+                log.warning("Writing " + filename + " failed: " + str(e))
+
+    def run(self):
+        self.config = loadConfig(self.path)
+        for camera in self.config['cameras']:
+            self.startRunner(camera)
+        lastMetrics = time.monotonic()
+        while not self.stopping.wait(1.0):
+            if self.reloadRequested:
+                self.reloadRequested = False
+                self.reload()
+            self.restartDead()
+            if self.config['metrics'] and time.monotonic() - lastMetrics >= self.metricsInterval:
+                self.writeMetrics(self.runners)
+                lastMetrics = time.monotonic()
+        log.info("Stopping")
+        runners = dict(self.runners)
+        for name in runners:
+            self.stopRunner(name)
+        if self.config['metrics']:
+            self.writeMetrics(runners)
+
+    # Both are called from signal handlers, the work happens in run()
+    def stop(self, *args):
+        self.stopping.set()
+
+    def requestReload(self, *args):
+        self.reloadRequested = True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless capture service for FLIR A320 cameras")
+    parser.add_argument('config', help="INI file with one [camera <name>] section per camera")
+    parser.add_argument('--check', action='store_true', help="validate the configuration and exit")
+    parser.add_argument('--log', default='INFO', help="log level")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log.upper(), format='[%(asctime)s] %(levelname)8s %(threadName)15s: %(message)s')
+    try:
+        config = loadConfig(args.config)
+    except ConfigError as e:
+        log.error(str(e))
+        sys.exit(2)
+    if args.check:
+        log.info("%s: %d camera(s), OK" % (args.config, len(config['cameras'])))
+        sys.exit(0)
+    daemon = Daemon(args.config)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    if hasattr(signal, 'SIGHUP'): # not on Windows
+        signal.signal(signal.SIGHUP, daemon.requestReload)
+    daemon.run()
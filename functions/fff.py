@@ -0,0 +1,271 @@
+# Reader for the radiometric .fff files of the camera (FLIR "FFF" format).
+# The layout follows the FLIR tags of ExifTool (FLIR.pm), see also
+# https://developer.flir.com/forums/topic/metadata-format/
+#
+# An FFF file starts with a 64 byte header, whose record directory points to
+# the records: 0x01 holds the raw 16-bit sensor values, 0x20 the camera info
+# with the Planck and atmospheric calibration constants.
+#
+#   frame = fff.load('file-20170903-120000.fff')
+#   T = frame.temperature()          # [°C], float32 array of height x width
+#
+# The conversion from raw values to temperatures computes all constants once,
+# then runs over the whole frame in one vectorized pass.
+
+import struct, zlib, datetime
+
+import numpy as np
+
+# Record types in the directory
+RAW_DATA = 0x01
+CAMERA_INFO = 0x20
+
+HEADER_SIZE = 0x40
+ENTRY_SIZE = 0x20
+
+class FFFError(ValueError):
+    pass
+
+# Offsets and formats of the fields of the camera info record
+CAMERA_INFO_FIELDS = {
+    'emissivity': (0x20, 'f'),
+    'objectDistance': (0x24, 'f'),           # [m]
+    'reflectedTemp': (0x28, 'f'),            # [K]
+    'atmosphericTemp': (0x2c, 'f'),          # [K]
+    'irWindowTemp': (0x30, 'f'),             # [K]
+    'irWindowTransmission': (0x34, 'f'),
+    'relativeHumidity': (0x3c, 'f'),         # [0.0-1.0]
+    'planckR1': (0x58, 'f'),
+    'planckB': (0x5c, 'f'),
+    'planckF': (0x60, 'f'),
+    'atmTransAlpha1': (0x70, 'f'),
+    'atmTransAlpha2': (0x74, 'f'),
+    'atmTransBeta1': (0x78, 'f'),
+    'atmTransBeta2': (0x7c, 'f'),
+    'atmTransX': (0x80, 'f'),
+    'planckO': (0x308, 'i'),
+    'planckR2': (0x30c, 'f'),
+}
+# Length a camera info record needs for all of the fields above
+CAMERA_INFO_SIZE = max(pos + struct.calcsize(fmt) for pos, fmt in CAMERA_INFO_FIELDS.values())
+# Capture time: seconds since 1970, milliseconds, time zone offset [min]
+CAMERA_INFO_TIME = 0x384
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# Byte order of the file: the version in the header is between 100 and 199
+def fileByteOrder(buf):
+    version = struct.unpack_from('>I', buf, 0x14)[0]
+    return '>' if 100 <= version < 200 else '<'
+
+# Byte order of a record: its first word is 2
+def recordByteOrder(buf, offset):
+    return '<' if struct.unpack_from('<H', buf, offset)[0] == 2 else '>'
+
+# Parse the header and the record directory.
+# Returns {record type: (offset, length)} for the first record of each type
+def directory(buf):
+    if len(buf) < HEADER_SIZE or bytes(buf[:4]) not in (b'FFF\0', b'AFF\0'):
+        raise FFFError("not an FFF file")
+    order = fileByteOrder(buf)
+    dirOffset, entries = struct.unpack_from(order + 'II', buf, 0x18)
+    if dirOffset + entries * ENTRY_SIZE > len(buf):
+        raise FFFError("record directory beyond the end of the file")
+    records = {}
+    for i in range(entries):
+        kind, sub, version, ident, offset, length = struct.unpack_from(order + 'HHIIII', buf, dirOffset + i * ENTRY_SIZE)
+        if kind and kind not in records:
+            if offset + length > len(buf):
+                raise FFFError("record 0x%02x beyond the end of the file" % kind)
+            records[kind] = (offset, length)
+    return records
+
+# Shape of the raw image and the position of its pixels in buf.
+# Returns (order, width, height, offset of the pixel data, length)
+def rawLayout(buf, offset, length):
+    if length < 0x20 or offset + length > len(buf):
+        raise FFFError("raw data record is truncated")
+    order = recordByteOrder(buf, offset)
+    width, height = struct.unpack_from(order + 'HH', buf, offset + 2)
+    return order, width, height, offset + 0x20, length - 0x20
+
+# The raw sensor values as a (height, width) uint16 array. Uncompressed data
+# is returned as a view on buf without copying
+def rawImage(buf, offset, length):
+    order, width, height, start, size = rawLayout(buf, offset, length)
+    if bytes(buf[start:start + 8]) == b'\x89PNG\r\n\x1a\n':
+        return decodePNG(bytes(buf[start:start + size]))
+    if size < width * height * 2:
+        raise FFFError("raw image data is truncated")
+    return np.frombuffer(buf, dtype=order + 'u2', count=width * height, offset=start).reshape(height, width)
+
+# Calibration constants and object parameters from the camera info record
+def cameraInfo(buf, offset, length):
+    if length < CAMERA_INFO_SIZE or offset + length > len(buf):
+        raise FFFError("camera info record is truncated")
+    order = recordByteOrder(buf, offset)
+    info = {}
+    for name, (pos, fmt) in CAMERA_INFO_FIELDS.items():
+        info[name] = struct.unpack_from(order + fmt, buf, offset + pos)[0]
+    # Some cameras store the humidity in percent
+    if info['relativeHumidity'] > 2:
+        info['relativeHumidity'] /= 100.0
+    if length >= CAMERA_INFO_TIME + 10:
+        seconds, millis = struct.unpack_from(order + 'II', buf, offset + CAMERA_INFO_TIME)
+        zone = struct.unpack_from(order + 'h', buf, offset + CAMERA_INFO_TIME + 8)[0]
+        # The seconds count in UTC; time is the local time of the camera
+        info['utcTime'] = EPOCH + datetime.timedelta(seconds=seconds, milliseconds=millis % 1000)
+        info['time'] = info['utcTime'] - datetime.timedelta(minutes=zone)
+    return info
+
+# 16-bit grayscale PNG as used by cameras that compress the raw data. FLIR
+# writes the words little-endian inside the big-endian PNG, so they are swapped
+def decodePNG(data):
+    pos = 8
+    chunks = []
+    width = height = None
+    while pos < len(data):
+        size, kind = struct.unpack_from('>I4s', data, pos)
+        body = data[pos + 8:pos + 8 + size]
+        if kind == b'IHDR':
+            width, height, depth, colour, _, _, interlace = struct.unpack('>IIBBBBB', body)
+            if depth != 16 or colour != 0 or interlace:
+                raise FFFError("unsupported PNG raw image")
+        elif kind == b'IDAT':
+            chunks.append(body)
+        elif kind == b'IEND':
+            break
+        pos += 12 + size
+    rows = np.frombuffer(zlib.decompress(b''.join(chunks)), np.uint8).reshape(height, 1 + width * 2)
+    filters = rows[:, 0]
+    pixels = rows[:, 1:].astype(np.int32)
+    bpp = 2
+    for y in range(height):
+        row = pixels[y]
+        up = pixels[y - 1] if y else np.zeros_like(row)
+        f = filters[y]
+        if f == 1: # Sub: running sum per byte of the pixel
+            for b in range(bpp):
+                row[b::bpp] = np.cumsum(row[b::bpp]) & 0xff
+        elif f == 2: # Up
+            row[:] = (row + up) & 0xff
+        elif f == 3: # Average
+            for x in range(len(row)):
+                left = row[x - bpp] if x >= bpp else 0
+                row[x] = (row[x] + ((left + up[x]) >> 1)) & 0xff
+        elif f == 4: # Paeth
+            for x in range(len(row)):
+                a = row[x - bpp] if x >= bpp else 0
+                c = up[x - bpp] if x >= bpp else 0
+                b = up[x]
+                p = a + b - c
+                pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+                pred = a if pa <= pb and pa <= pc else (b if pb <= pc else c)
+                row[x] = (row[x] + pred) & 0xff
+    return pixels.astype(np.uint8).view('<u2').reshape(height, width)
+
+# Scalars of the raw-to-temperature conversion. The object signal is
+# raw * gain - offset, see Thermimage::raw2temp by Glenn J. Tattersall
+def coefficients(info):
+    R1, R2, B, F, O = info['planckR1'], info['planckR2'], info['planckB'], info['planckF'], info['planckO']
+    E = info['emissivity']
+    OD = info['objectDistance']
+    RTemp = info['reflectedTemp']
+    ATemp = info['atmosphericTemp']
+    IRWTemp = info['irWindowTemp']
+    IRT = info['irWindowTransmission'] or 1.0
+    RH = info['relativeHumidity']
+    X = info['atmTransX']
+    ATA1, ATA2, ATB1, ATB2 = info['atmTransAlpha1'], info['atmTransAlpha2'], info['atmTransBeta1'], info['atmTransBeta2']
+    emissWind = 1 - IRT
+    reflWind = 0
+    # Water vapour content and transmission of the atmosphere
+    t = ATemp - 273.15
+    h2o = RH * np.exp(1.5587 + 0.06939 * t - 0.00027816 * t ** 2 + 0.00000068455 * t ** 3)
+    def tau(distance):
+        return (X * np.exp(-np.sqrt(distance) * (ATA1 + ATB1 * np.sqrt(h2o)))
+                + (1 - X) * np.exp(-np.sqrt(distance) * (ATA2 + ATB2 * np.sqrt(h2o))))
+    tau1 = tau(OD / 2)
+    tau2 = tau(OD / 2)
+    # Radiance of a black body at T [K], in raw units
+    def planck(T):
+        return R1 / (R2 * (np.exp(B / T) - F)) - O
+    rawRefl1 = planck(RTemp)
+    rawAtm = planck(ATemp)
+    rawWind = planck(IRWTemp)
+    offset = ((1 - E) / E * rawRefl1
+              + (1 - tau1) / E / tau1 * rawAtm
+              + emissWind / E / tau1 / IRT * rawWind
+              + reflWind / E / tau1 / IRT * rawRefl1
+              + (1 - tau2) / E / tau1 / IRT / tau2 * rawAtm)
+    gain = 1 / (E * tau1 * IRT * tau2)
+    return float(gain), float(offset)
+
+# Temperatures [°C] of raw sensor values. Parameters in override replace the
+# ones stored in the file, e.g. emissivity=0.95 or reflectedTemp=293.15
+def temperature(raw, info, dtype=np.float32, **override):
+    if override:
+        info = dict(info, **override)
+    gain, offset = coefficients(info)
+    R1, R2, B, F, O = info['planckR1'], info['planckR2'], info['planckB'], info['planckF'], info['planckO']
+    signal = raw.astype(dtype)
+    signal *= gain
+    signal += O - offset
+    # B / log(R1 / (R2 * signal) + F) - 273.15, computed in place
+    signal *= R2
+    np.divide(R1, signal, out=signal)
+    signal += F
+    np.log(signal, out=signal)
+    np.divide(B, signal, out=signal)
+    signal -= 273.15
+    return signal
+
+# A decoded FFF file
+class Frame(object):
+    def __init__(self, raw, info):
+        self.raw = raw
+        self.info = info
+
+    @property
+    def time(self):
+        return self.info.get('time')
+
+    # Temperatures [°C] of the whole frame, or of roi, e.g. (slice(0, 10), slice(0, 20))
+    def temperature(self, roi=None, dtype=np.float32, **override):
+        raw = self.raw if roi is None else self.raw[roi]
+        return temperature(raw, self.info, dtype, **override)
+
+# Decode an FFF file from a buffer (bytes, memoryview or mmap). The raw image
+# stays a view on buf
+def read(buf):
+    records = directory(buf)
+    if RAW_DATA not in records or CAMERA_INFO not in records:
+        raise FFFError("raw data or camera info record missing")
+    return Frame(rawImage(buf, *records[RAW_DATA]), cameraInfo(buf, *records[CAMERA_INFO]))
+
+# The FFF data embedded in a radiometric JPEG of the camera. It is split over
+# APP1 segments starting with 'FLIR\0', each with its number at byte 6
+def fromJPEG(buf):
+    buf = bytes(buf)
+    if buf[:2] != b'\xff\xd8':
+        raise FFFError("not a JPEG file")
+    parts = {}
+    pos = 2
+    while pos + 4 <= len(buf) and buf[pos] == 0xff:
+        marker = buf[pos + 1]
+        if marker == 0xda: # start of scan, no more metadata
+            break
+        size = struct.unpack_from('>H', buf, pos + 2)[0]
+        if marker == 0xe1 and buf[pos + 4:pos + 9] == b'FLIR\0':
+            parts[buf[pos + 10]] = buf[pos + 12:pos + 2 + size]
+        pos += 2 + size
+    if not parts:
+        raise FFFError("no radiometric data in the JPEG file")
+    return b''.join(parts[n] for n in sorted(parts))
+
+# Decode an .fff file, or the radiometric data of a .jpg file
+def load(filename):
+    with open(filename, 'rb') as f:
+        data = f.read()
+    if data[:2] == b'\xff\xd8':
+        data = fromJPEG(data)
+    return read(data)
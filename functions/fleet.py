@@ -0,0 +1,183 @@
+# Capture many cameras on the same cadence from one process.
+# All cameras are triggered together so that their frames stay time-aligned,
+# then the images are transferred through a bounded pool of workers. A camera
+# that fails is reported and reconnected in the background, with a growing
+# delay between attempts, while the others carry on at the same cadence.
+#
+#   python -m functions.fleet 192.168.1.10 192.168.1.11 --interval 60 --out logs
+
+import argparse, asyncio, os, time
+
+from functions.asyncflir import AsyncFLIR
+from functions.flir import FLIRError, FileSink, SinkError, deliver
+from functions.scheduler import DeadlineScheduler
+
+import logging
+log = logging.getLogger('root')
+
+# Delay before reconnecting a camera [s]: doubles with every failed attempt
+# from the first value up to the second
+BACKOFF = (1, 60)
+
+# Name of a camera in reports and output folders
+def cameraName(cam):
+    if cam.port == 23:
+        return cam.host
+    return cam.host + ':' + str(cam.port)
+
+class Fleet(object):
+    # cameras are host names or AsyncFLIR instances. workers is the number of
+    # transfers running at the same time. sink(data, meta) receives every frame,
+    # meta['host'] tells which camera it comes from
+    def __init__(self, cameras, workers=4, fmt='jpg', sink=None):
+        self.cameras = [c if isinstance(c, AsyncFLIR) else AsyncFLIR(c) for c in cameras]
+        self.workers = workers
+        self.fmt = fmt
+        self.sink = sink
+        self.transfers = None
+        self.scheduler = None
+        self.connecting = {} # camera: reconnect task
+        self.failures = {}   # camera: (last connect error, attempts, monotonic time of the next attempt)
+
+    # Connect all cameras that are not connected and wait for them.
+    # Returns {host: error or None}
+    async def connect(self):
+        cams = [c for c in self.cameras if c.writer is None and c not in self.connecting]
+        await asyncio.gather(*[self.reconnect(c) for c in cams])
+        return dict((cameraName(c), self.failures[c][0] if c in self.failures else None) for c in cams)
+
+    async def connectCamera(self, cam):
+        await cam.connect()
+        await cam.setDateTime()
+
+    async def reconnect(self, cam):
+        try:
+            await self.connectCamera(cam)
+        except (FLIRError, EOFError, OSError) as e:
+            cam.abort()
+            attempts = self.failures[cam][1] if cam in self.failures else 0
+            delay = min(BACKOFF[0] * 2 ** attempts, BACKOFF[1])
+            self.failures[cam] = (e, attempts + 1, time.monotonic() + delay)
+            log.info("Connecting to %s failed (%r), next attempt in %.0f s" % (cameraName(cam), e, delay))
+        else:
+            if cam in self.failures:
+                log.info("Camera " + cameraName(cam) + " reconnected")
+            self.failures.pop(cam, None)
+        finally:
+            self.connecting.pop(cam, None)
+
+    # Start reconnecting the cameras that are down in the background, so that a
+    # host that does not answer never delays the shots of the others
+    def reconnectLater(self):
+        now = time.monotonic()
+        for cam in self.cameras:
+            if cam.writer is None and cam not in self.connecting and (cam not in self.failures or self.failures[cam][2] <= now):
+                self.connecting[cam] = asyncio.ensure_future(self.reconnect(cam))
+
+    # Trigger, transfer and delete one frame on every camera.
+    # Returns a report with, per host, the store and transfer latency [s] or the
+    # error, and the skew [s] between the first and the last camera's store
+    async def shoot(self):
+        if self.transfers is None:
+            self.transfers = asyncio.Semaphore(self.workers)
+        self.reconnectLater()
+        cams = [c for c in self.cameras if c.writer is not None and c not in self.connecting]
+        start = time.perf_counter()
+        results = await asyncio.gather(*[self.shootCamera(c, start) for c in cams], return_exceptions=True)
+        report = {'time': time.time(), 'cameras': {}}
+        stored = []
+        for cam, result in zip(cams, results):
+            if isinstance(result, BaseException):
+                if not isinstance(result, (FLIRError, EOFError, OSError)):
+                    raise result
+                log.info("Camera " + cameraName(cam) + " failed: " + repr(result))
+                if not isinstance(result, SinkError): # the link is fine if only the sink failed
+                    cam.abort()
+                report['cameras'][cameraName(cam)] = {'error': result}
+            else:
+                report['cameras'][cameraName(cam)] = result
+                stored.append(result['storeLatency'])
+        for cam in self.cameras:
+            if cameraName(cam) not in report['cameras']:
+                error = self.failures[cam][0] if cam in self.failures else FLIRError("connecting")
+                report['cameras'][cameraName(cam)] = {'error': error}
+        report['skew'] = max(stored) - min(stored) if stored else 0.0
+        return report
+
+    async def shootCamera(self, cam, start):
+        meta = await cam.store(self.fmt)
+        stored = time.perf_counter() - start
+        async with self.transfers:
+            begin = time.perf_counter()
+            data = await cam.fetch(meta['remote'])
+            transfer = time.perf_counter() - begin
+        await cam.delete(meta['remote'])
+        result = {'storeLatency': stored, 'transferLatency': transfer, 'size': len(data)}
+        if self.sink is not None:
+            meta['host'] = cameraName(cam)
+            meta.update(result)
+            deliver(self.sink, data, meta)
+        return result
+
+    # Shoot every interval seconds, count times or forever. The shots are aimed
+    # at absolute deadlines so that slow shots do not make the cadence drift
+    async def run(self, interval, count=None, report=None):
+        await self.connect()
+        self.scheduler = DeadlineScheduler(interval)
+        while count is None or self.scheduler.fired < count:
+            await asyncio.sleep(self.scheduler.delay())
+            slot = self.scheduler.due()
+            if slot is None:
+                continue
+            if slot['missed']:
+                log.warning(str(slot['missed']) + " shot(s) missed")
+            result = await self.shoot()
+            result['slot'] = slot
+            if report is not None:
+                report(result)
+
+    async def close(self):
+        for task in list(self.connecting.values()):
+            task.cancel()
+        await asyncio.gather(*self.connecting.values(), return_exceptions=True)
+        await asyncio.gather(*[c.close() for c in self.cameras], return_exceptions=True)
+
+# Write the frames of every camera to its own folder below path
+class FleetSink(object):
+    def __init__(self, path):
+        self.path = path
+        self.sinks = {}
+
+    def __call__(self, data, meta):
+        if meta['host'] not in self.sinks:
+            folder = os.path.join(self.path, meta['host'].replace(':', '_'))
+            os.makedirs(folder, exist_ok=True)
+            self.sinks[meta['host']] = FileSink(folder + os.sep)
+        return self.sinks[meta['host']](data, meta)
+
+def printReport(report):
+    for host, r in sorted(report['cameras'].items()):
+        if 'error' in r:
+            log.info("%-20s failed: %s" % (host, r['error']))
+        else:
+            log.info("%-20s store %.3f s, transfer %.3f s" % (host, r['storeLatency'], r['transferLatency']))
+    log.info("skew %.3f s" % report['skew'])
+
+async def main(args):
+    fleet = Fleet(args.hosts, args.workers, args.format, FleetSink(args.out))
+    try:
+        await fleet.run(args.interval, args.count, printReport)
+    finally:
+        await fleet.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Capture several FLIR A320 on the same cadence")
+    parser.add_argument('hosts', nargs='+')
+    parser.add_argument('--interval', type=float, default=60, help="seconds between shots")
+    parser.add_argument('--count', type=int, default=None, help="number of shots, default: run forever")
+    parser.add_argument('--workers', type=int, default=4, help="concurrent transfers")
+    parser.add_argument('--format', choices=['jpg', 'fff'], default='jpg')
+    parser.add_argument('--out', default='.', help="output folder")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)8s %(module)15s: %(message)s')
+    asyncio.run(main(args))
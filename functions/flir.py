@@ -1,153 +1,710 @@
 # With help from https://stackoverflow.com/questions/20484984/telnet-read-until-function-doesnt-work
 
-import telnetlib , socket, ftplib, time, datetime
+import socket, ftplib, time, datetime, re, itertools, random, struct
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import telnetlib
+except ImportError: # removed in Python 3.13, only AsyncFLIR works there
+    telnetlib = None
+
+from functions.metrics import Metrics
+from functions.resources import RESOURCES, ResourceError, parseValue
 
 import logging
 log = logging.getLogger('root')
 
+# Raised when the camera shell answers with an error message
+class FLIRError(Exception):
+    pass
+
+# Raised when the camera does not answer within the deadline of a command
+class FLIRTimeout(FLIRError, socket.timeout):
+    pass
+
+# Raised when the sink of a shot fails, e.g. on a full disk. It is a FLIRError
+# for the callers that report failed shots, but not a link error: an OSError
+# of the disk must not make the Supervisor drop a working connection
+class SinkError(FLIRError):
+    pass
+
+# Hand a frame to sink and return what it returns, its errors as SinkError
+def deliver(sink, data, meta):
+    try:
+        return sink(data, meta)
+    except Exception as e:
+        raise SinkError("sink failed: %s: %s" % (type(e).__name__, e)) from e
+
+# The camera shell prints one of these when a command is rejected
+ERROR_REPLY = re.compile(r'error|unknown|not found|invalid|illegal', re.IGNORECASE)
+
+# Store command and file extension of the image formats
+FORMATS = {
+    'jpg': (b'store -j ', '.jpg'),
+    'fff': (b'store ', '.fff'),
+}
+
+# Strip the prompt and the echo from the reply to cmd, and raise FLIRError if
+# the camera rejected the command
+def parseReply(cmd, reply, token):
+    # The shell prompt is '\\>', only its last character is used as token
+    reply = reply[:-len(token)].rstrip('\\').strip()
+    # Drop the echo of the command if the shell sends one
+    if reply.startswith(cmd.decode('ascii')):
+        reply = reply[len(cmd):].strip()
+    if ERROR_REPLY.search(reply):
+        raise FLIRError(cmd.decode('ascii') + ": " + reply)
+    return reply
+
+# Camera resource path and checked value text for one of the resources of
+# functions.resources, raises ResourceError for an invalid value
+def paramValue(name, value):
+    try:
+        resource = RESOURCES[name]
+    except KeyError:
+        raise ResourceError("unknown resource " + name)
+    return resource.path, resource.encode(value)
+
+# rset command for one of the resources of functions.resources
+def paramCommand(name, value):
+    resource, value = paramValue(name, value)
+    return b'rset ' + resource.encode('ascii') + b' ' + value.encode('ascii')
+
+# Resources read into the state cache of FLIR when connecting
+STATE = [r.path for r in RESOURCES.values() if r.cached]
+
+# True if two value texts of a resource mean the same, e.g. '0.5' and '5.0e-01'
+def sameValue(a, b):
+    a, b = a.strip().strip('"'), b.strip().strip('"')
+    try:
+        return abs(float(a) - float(b)) <= 1e-6 * max(abs(float(a)), 1.0)
+    except ValueError:
+        return a.lower() == b.lower()
+
+# Shell commands that get a phase of their own in the metrics
+PHASES = ('rset', 'rget', 'store', 'del', 'date', 'time')
+
+# Phase name of a shell command for the metrics: its first word, e.g. rset
+# or store. Replies to prompts (date, time) are counted as 'input', empty
+# commands, which only bring back the prompt, as 'probe', and any other
+# command as 'other', so that free-form requests cannot add labels without end
+def commandPhase(cmd):
+    word = cmd.split(b' ', 1)[0]
+    if not word:
+        return 'probe'
+    if not word.isalpha():
+        return 'input'
+    word = word.decode('ascii')
+    return word if word in PHASES else 'other'
+
+# File name of a frame: date and time of the capture to the millisecond and a
+# sequence number, so that shots within the same second get their own files
+def frameName(meta, sequence):
+    t = meta['time']
+    return 'file-' + t.strftime('%Y%m%d-%H%M%S') + '-%03d-%06d' % (t.microsecond // 1000, sequence) + FORMATS[meta['format']][1]
+
+# Sink for FLIR.capture() that writes every frame to a file in path, named
+# with the date and time of the capture
+class FileSink(object):
+    def __init__(self, path):
+        self.path = path
+        self.sequence = itertools.count()
+
+    def __call__(self, data, meta):
+        filename = self.path + frameName(meta, next(self.sequence))
+        with open(filename, 'wb') as f:
+            f.write(data)
+        return filename
+
 class FLIR(object):
-    def __init__(self, host):
+    def __init__(self, host, port=23, ftpPort=21):
         self.tn = None
         self.host = host # should be 192.168.1.10
-        self.port = 23
+        self.port = port
         self.timeout = 2
+        self.prompt = b'>'
+        # Deadlines [s] per kind of command. The camera answers with the prompt as
+        # soon as a command has completed, so these are upper limits, not delays
+        self.timeouts = {
+            'connect': 2,
+            'default': 1,
+            'store': 10,
+            'focus': 10,
+        }
+        # FTP session for the image transfers, kept open between shots
+        self.ftp = None
+        self.ftpPort = ftpPort
+        self.ftpKeepalive = 30 # [s] idle time after which the session is checked with NOOP
+        self.ftpLastUsed = 0
+        self.ftpStats = {'logins': 0, 'loginTime': 0.0, 'transfers': 0, 'transferTime': 0.0, 'reconnects': 0}
+        # Numbers for unique file names on the camera, so that shots never overwrite
+        # each other. A random start keeps several clients on one camera apart
+        self.shotNumbers = itertools.count(random.randrange(10000000))
+        # Last known value text of every camera resource, filled by rget when
+        # connecting and kept up to date by rset. Writes of unchanged values are skipped
+        self.state = {}
+        # Latency of every phase (connect, rset, store, ftpConnect, ftpLogin,
+        # retr, del, ...) and counters of timeouts, errors and retries
+        self.metrics = Metrics()
 
     def connect(self):
+        if telnetlib is None:
+            raise FLIRError("telnetlib is not available in this Python version, use functions.asyncflir.AsyncFLIR")
+        start = time.perf_counter()
         try :
             self.tn = telnetlib.Telnet(self.host,self.port,self.timeout)
         except socket.timeout :
             log.info("FLIR.connect() socket.timeout")
+            self.metrics.count('timeouts')
+            raise FLIRTimeout("FLIR.connect(): no answer from " + self.host)
         # when connecting, just read until you reach the prompt
-        self.tn.read_until(b'msc]',1)
-		
+        self.expect(b'msc]', self.timeouts['connect'])
+        self.expect(self.prompt, self.timeouts['connect'])
+        self.metrics.observe('connect', time.perf_counter() - start)
+        self.invalidate()
+        self.getMany(STATE)
+
+    # The telnet session, or EOFError if there is none, e.g. after a timeout
+    def session(self):
+        if self.tn is None:
+            raise EOFError("telnet session closed, reconnect first")
+        return self.tn
+
+    # Wait until the camera sends the expected token, or raise FLIRTimeout after
+    # the deadline. Returns everything received up to and including the token.
+    # After a timeout the session is closed: the late reply would otherwise be
+    # taken as the reply to the next command
+    def expect(self, token=None, timeout=None):
+        if token is None:
+            token = self.prompt
+        if timeout is None:
+            timeout = self.timeouts['default']
+        reply = self.session().read_until(token, timeout)
+        if not reply.endswith(token):
+            self.metrics.count('timeouts')
+            self.tn.close()
+            self.tn = None
+            raise FLIRTimeout("expected " + repr(token) + " within " + str(timeout) + " s, got " + repr(reply))
+        return reply.decode('ascii', 'replace')
+
+    # Send a command and wait for its completion. kind selects the deadline from
+    # self.timeouts. Returns the reply of the camera without the prompt
+    def command(self, cmd, kind='default', expect=None):
+        if isinstance(cmd, str):
+            cmd = cmd.encode('ascii')
+        start = time.perf_counter()
+        self.session().write(cmd + b'\n')
+        reply = self.expect(expect, self.timeouts.get(kind, self.timeouts['default']))
+        self.metrics.observe(commandPhase(cmd), time.perf_counter() - start)
+        try:
+            return parseReply(cmd, reply, expect or self.prompt)
+        except FLIRError:
+            self.metrics.count('errors')
+            raise
+
+    # Send several commands in one write, then collect one prompt per command.
+    # Returns a list with the reply of every command, or the FLIRError it
+    # raised. A missing prompt still raises FLIRTimeout, as the replies could
+    # no longer be matched to their commands. If stamps is a list, the time at
+    # which each command completed is appended to it
+    def pipeline(self, cmds, kind='default', stamps=None):
+        cmds = [c.encode('ascii') if isinstance(c, str) else c for c in cmds]
+        if not cmds:
+            return []
+        start = time.perf_counter()
+        self.session().write(b''.join(c + b'\n' for c in cmds))
+        timeout = self.timeouts.get(kind, self.timeouts['default'])
+        replies = []
+        for cmd in cmds:
+            reply = self.expect(self.prompt, timeout)
+            # The time since the previous prompt is what this command added
+            now = time.perf_counter()
+            self.metrics.observe(commandPhase(cmd), now - start)
+            start = now
+            if stamps is not None:
+                stamps.append(datetime.datetime.now())
+            try:
+                replies.append(parseReply(cmd, reply, self.prompt))
+            except FLIRError as e:
+                self.metrics.count('errors')
+                replies.append(e)
+        self.metrics.count('pipelines')
+        return replies
+
+    # Value text of a camera resource, from the cache unless refresh is set
+    def rget(self, resource, refresh=False):
+        if refresh or resource not in self.state:
+            reply = self.command(b'rget ' + resource.encode('ascii'))
+            self.state[resource] = self.rgetValue(resource, reply)
+        return self.state[resource]
+
+    # Values of several resources. The ones that are not cached are read in one
+    # round trip. Resources the camera does not know are left out
+    def getMany(self, resources, refresh=False):
+        missing = [r for r in resources if refresh or r not in self.state]
+        for resource, reply in zip(missing, self.pipeline([b'rget ' + r.encode('ascii') for r in missing])):
+            if isinstance(reply, FLIRError):
+                log.debug("Reading " + resource + " failed: " + str(reply))
+            else:
+                self.state[resource] = self.rgetValue(resource, reply)
+        return dict((r, self.state[r]) for r in resources if r in self.state)
+
+    # Some firmware repeats the resource name before the value
+    def rgetValue(self, resource, reply):
+        if reply.startswith(resource):
+            reply = reply[len(resource):]
+        return reply.strip()
+
+    # Forget the cached value of resource, or of all resources, e.g. after the
+    # settings were changed on the camera itself
+    def invalidate(self, resource=None):
+        if resource is None:
+            self.state = {}
+        else:
+            self.state.pop(resource, None)
+
+    # Set a camera resource. Nothing is sent if the cache shows that the camera
+    # already has this value, unless force is set. Returns True if it was sent
+    def rset(self, resource, value, force=False, kind='default'):
+        value = str(value)
+        if not force and resource in self.state and sameValue(self.state[resource], value):
+            self.metrics.count('suppressed')
+            return False
+        try:
+            self.command(b'rset ' + resource.encode('ascii') + b' ' + value.encode('ascii'), kind)
+        except FLIRError:
+            self.state.pop(resource, None)
+            raise
+        self.state[resource] = value
+        return True
+
+    # Set a resource of functions.resources by its short name, e.g.
+    # cam.set('atmT', 20). The value is checked against the type and range of
+    # the resource first, ResourceError is raised if it does not fit
+    def set(self, name, value, force=False):
+        path, text = paramValue(name, value)
+        resource = RESOURCES[name]
+        sent = self.rset(path, text, force or not resource.cached, resource.command)
+        if not resource.cached:
+            self.state.pop(path, None)
+        return sent
+
+    # Typed value of a resource of functions.resources, e.g. cam.get('atmT') in °C
+    def get(self, name, refresh=False):
+        return parseValue(RESOURCES[name].path, self.rget(RESOURCES[name].path, refresh))
+
+    # Set several parameters in a single round trip, e.g.
+    # cam.applyParams(rh=0.5, dist=2, ambT=20, atmT=20, emiss=0.95, pal='iron')
+    # Returns a dict with None for every parameter that was set or already had
+    # this value, or the FLIRError with the reason why the camera rejected it
+    def applyParams(self, **params):
+        result = {}
+        changes = []
+        for name, value in params.items():
+            resource, text = paramValue(name, value)
+            if resource in self.state and sameValue(self.state[resource], text):
+                self.metrics.count('suppressed')
+                result[name] = None
+            else:
+                changes.append((name, resource, text))
+        replies = self.pipeline([b'rset ' + r.encode('ascii') + b' ' + t.encode('ascii') for n, r, t in changes])
+        for (name, resource, text), reply in zip(changes, replies):
+            if isinstance(reply, FLIRError):
+                log.info("Setting " + name + " failed: " + str(reply))
+                result[name] = reply
+                self.state.pop(resource, None)
+            else:
+                result[name] = None
+                self.state[resource] = text
+        return result
+
     # Set camera date and time to the computer time
     def setDateTime(self):
         # Set the date
-        self.tn.write(b'date\n')
-        self.tn.read_until(b'Enter new date (mm/dd/yyyy): ',1).decode('ascii')
+        self.command(b'date', expect=b'Enter new date (mm/dd/yyyy): ')
         datenow = str(datetime.datetime.now().strftime('%m/%d/%Y')).encode('ascii') # store date string
-        self.tn.write(datenow + b'\n')
-        self.tn.read_until(b'>',1).decode('ascii')
+        self.command(datenow)
         # Set the time
-        self.tn.write(b'time\n')
-        self.tn.read_until(b'Enter new time: ',1).decode('ascii')
+        self.command(b'time', expect=b'Enter new time: ')
         timenow = str(datetime.datetime.now().strftime('%H:%M:%S')).encode('ascii') # store time string
-        self.tn.write(timenow + b'\n')
-        self.tn.read_until(b'>',1).decode('ascii')
+        self.command(timenow)
         # Check date and time
         #self.tn.write(b'date /T\n')
         #self.tn.write(b'time /T\n')
-		
+
     # Set file format to file containing temperature data
     def setFormat(self):
-        self.tn.write(b'rset .image.services.store.format \"JPEG+PNG\"\n')
-        self.tn.read_until(b'>',1).decode('ascii')
-		
-    # Set relative humidity [0.0-1-0]
-    def setRH(self, rh): # standard should be rh= 0.5
-        self.tn.write(b'rset .image.sysimg.basicImgData.objectParams.relHum ' + str(rh).encode('ascii') + b'\n')
-        self.tn.read_until(b'>',1).decode('ascii')
-		
-    # Set object distance [m]
-    def setDist(self, distance):
-        self.tn.write(b'rset .image.sysimg.basicImgData.objectParams.objectDistance ' + str(distance).encode('ascii') + b'\n')
-        self.tn.read_until(b'>',1).decode('ascii')
-		
-    # Set ambient T [°C]
-    def setAmbT(self, T):
-        self.tn.write(b'rset .image.sysimg.basicImgData.objectParams.ambTemp ' + str(T + 273.15).encode('ascii') + b'\n')
-        self.tn.read_until(b'>',1).decode('ascii')
-		
-    # Set atm T [°C]
-    def setAtmT(self, T):
-        self.tn.write(b'rset .image.sysimg.basicImgData.objectParams.atmTemp ' + str(T + 273.15).encode('ascii') + b'\n')
-        self.tn.read_until(b'>',1).decode('ascii')
-		
-    # Set object emissivity (0.001-1.0)
-    # Set atm T [°C]
-    def setEmiss(self, E):
-        self.tn.write(b'rset .image.sysimg.basicImgData.objectParams.emissivity ' + str(E).encode('ascii') + b'\n')
-        self.tn.read_until(b'>',1).decode('ascii')
-		
-    # Set colour palette
-    # pal can be: bw, iron, rainbow. I like iron the most
-    def setPal(self, pal):
-        self.tn.write(b'rset .image.sysimg.palette.readFile ' + pal.encode('ascii') + b'\n')
-        self.tn.read_until(b'>',1).decode('ascii')
-		
+        self.set('format', 'JPEG+PNG')
+
     # Quick Autofocus
     def quickFocus(self):
-        self.tn.write(b'rset .system.focus.autofast true\n')
-        time.sleep(2)
-        self.tn.read_until(b'>',1).decode('ascii')
+        self.set('autofast', True)
 
     # Slow but full autofocus
     def slowFocus(self):
-        self.tn.write(b'rset .system.focus.autofull true\n')
-        time.sleep(5)
-        self.tn.read_until(b'>',1).decode('ascii')
+        self.set('autofull', True)
 
     # Enable/disable overlay
     def overlay(self,enable):
         if(enable):
             print('enable')
             # Enable the legend
-            self.tn.write(b'rset .image.services.store.overlay true\n')
-            self.tn.read_until(b'>',1).decode('ascii')
+            self.set('overlay', True)
         else:
             print('disable')
             # Disable the legend
-            self.tn.write(b'rset .image.services.store.overlay false\n')
-            self.tn.read_until(b'>',1).decode('ascii')
-			
+            self.set('overlay', False)
+
     # Enable/disable legend
     def legend(self,enable):
         if(enable):
             print('enable')
             # Enable the legend
-            self.tn.write(b'rset .gui.system.hideGraphics false\n')
-            self.tn.read_until(b'>',1).decode('ascii')
+            self.set('hideGraphics', False)
         else:
             print('disable')
             # Disable the legend
-            self.tn.write(b'rset .gui.system.hideGraphics true\n')
-            self.tn.read_until(b'>',1).decode('ascii')
-		
-    # Shoot image and transfer
-    def shootJPG(self,path): #TODO: OPTION TO SET PATH!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
-        # shoot the image and store it temporarily on the camera
-        self.tn.write(b'store -j temp.jpg\n')
-        time.sleep(2)
-        # Set the filename for storage on the computer, with date/time info
-        filename = path + 'file-' + str(datetime.datetime.now().strftime('%Y%m%d-%H%M%S')) + '.jpg'
+            self.set('hideGraphics', True)
+
+    # Open the FTP session used for the image transfers
+    def ftpConnect(self):
+        start = time.perf_counter()
+        self.ftp = ftplib.FTP()
+        self.ftp.connect(self.host, self.ftpPort, self.timeout)
+        connected = time.perf_counter()
+        self.ftp.login()
+        self.ftp.cwd('/')
+        end = time.perf_counter()
+        self.metrics.observe('ftpConnect', connected - start)
+        self.metrics.observe('ftpLogin', end - connected)
+        self.ftpStats['logins'] += 1
+        self.ftpStats['loginTime'] += end - start
+        self.ftpLastUsed = time.time()
+
+    def ftpClose(self):
+        if self.ftp is not None:
+            try:
+                self.ftp.quit()
+            except ftplib.all_errors:
+                self.ftp.close()
+            self.ftp = None
+
+    # Return a working FTP session. A session that was idle for a while is
+    # checked first, and opened again if the server has dropped it
+    def ftpSession(self):
+        if self.ftp is None:
+            self.ftpConnect()
+        elif time.time() - self.ftpLastUsed > self.ftpKeepalive:
+            self.keepalive()
+        return self.ftp
+
+    # Send a NOOP so that the server does not drop an idle session. Can be called
+    # between shots of a slow logging interval
+    def keepalive(self):
+        if self.ftp is None:
+            return
+        try:
+            self.ftp.voidcmd('NOOP')
+            self.ftpLastUsed = time.time()
+        except ftplib.all_errors:
+            log.info("FTP session dropped, reconnecting")
+            self.ftpStats['reconnects'] += 1
+            self.metrics.count('ftpReconnects')
+            self.ftp.close()
+            self.ftpConnect()
+
+    # Download a file from the camera into callback. If the session breaks during
+    # the transfer, it is opened again and the download resumes where it stopped
+    def retrieve(self, remote, callback):
+        received = [0]
+        def receive(block):
+            received[0] += len(block)
+            callback(block)
+        for attempt in range(2):
+            ftp = self.ftpSession()
+            start = time.perf_counter()
+            try:
+                ftp.retrbinary('RETR ' + remote, receive, rest=received[0] or None)
+            except ftplib.error_perm:
+                raise
+            except ftplib.all_errors:
+                if attempt:
+                    raise
+                log.info("FTP transfer of " + remote + " failed, reconnecting")
+                self.ftpStats['reconnects'] += 1
+                self.metrics.count('retries')
+                self.ftp.close()
+                self.ftp = None
+                continue
+            self.ftpLastUsed = time.time()
+            elapsed = time.perf_counter() - start
+            self.metrics.observe('retr', elapsed)
+            self.ftpStats['transfers'] += 1
+            self.ftpStats['transferTime'] += elapsed
+            return received[0]
+
+    # Transfer statistics. savedPerFrame is the mean login time [s] that reusing
+    # the session spares every transfer that did not need its own login
+    def transferStats(self):
+        stats = dict(self.ftpStats)
+        logins = max(stats['logins'], 1)
+        transfers = max(stats['transfers'], 1)
+        reused = max(stats['transfers'] - stats['logins'], 0)
+        stats['meanTransferTime'] = stats['transferTime'] / transfers
+        stats['savedPerFrame'] = stats['loginTime'] / logins * reused / transfers
+        return stats
+
+    # Timing histograms and counters, see functions.metrics
+    def metricsSnapshot(self):
+        return self.metrics.snapshot()
+
+    def metricsText(self):
+        return self.metrics.prometheus({'camera': self.host if self.port == 23 else self.host + ':' + str(self.port)})
+
+    # Download a file from the camera into memory. The buffer is allocated once
+    # with the size reported by the server, then filled in place
+    def retrieveBytes(self, remote):
+        try:
+            size = self.ftpSession().size(remote) or 0
+        except ftplib.error_perm:
+            size = 0 # SIZE not supported, let the buffer grow instead
+        buf = bytearray(size)
+        pos = [0]
+        def receive(block):
+            # Slice assignment fills the buffer in place, and only grows it if
+            # the file turns out larger than announced
+            end = pos[0] + len(block)
+            buf[pos[0]:end] = block
+            pos[0] = end
+        self.retrieve(remote, receive)
+        del buf[pos[0]:]
+        return memoryview(buf)
+
+    # Unique name for a new file on the camera. Kept within 8.3 characters
+    def remoteName(self, fmt):
+        return 'f%07d' % (next(self.shotNumbers) % 10000000) + FORMATS[fmt][1]
+
+    # shoot the image and store it temporarily on the camera. The prompt comes
+    # back once the file is written. Returns the metadata of the shot
+    def store(self, fmt='jpg', remote=None):
+        if remote is None:
+            remote = self.remoteName(fmt)
+        meta = {'format': fmt, 'remote': remote, 'time': datetime.datetime.now()}
+        start = time.perf_counter()
+        self.command(FORMATS[fmt][0] + remote.encode('ascii'), 'store')
+        meta['storeTime'] = time.perf_counter() - start
+        return meta
+
+    # Delete several files on the camera in one round trip
+    def deleteFiles(self, remotes):
+        for remote, reply in zip(remotes, self.pipeline([b'del ' + r.encode('ascii') for r in remotes])):
+            if isinstance(reply, FLIRError):
+                log.info("Deleting " + remote + " failed: " + str(reply))
+
+    # Shoot an image and return its content without touching the disk.
+    # fmt is 'jpg' or 'fff'. Returns (data, meta), data is a memoryview of the
+    # file and meta holds the capture metadata. If a sink is given, it is called
+    # as sink(data, meta) and its return value is put in meta['stored']; its
+    # errors are raised as SinkError
+    def capture(self, fmt='jpg', sink=None, remote=None):
+        meta = self.store(fmt, remote)
+        remote = meta['remote']
         # Transmit file from the camera through FTP
-        ftp = ftplib.FTP(self.host)
-        ftp.login()
-        ftp.cwd('/')
-        ftp.retrbinary('RETR ' + 'temp.jpg', open(filename,'wb').write)
-        ftp.quit()
+        start = time.perf_counter()
+        data = self.retrieveBytes(remote)
+        meta['transferTime'] = time.perf_counter() - start
+        meta['size'] = len(data)
         # After successful transmission of the file, delete it on the camera
-        self.tn.write(b'del temp.jpg\n')
-        self.tn.read_until(b'>',1).decode('ascii')
-        return filename
-		
+        self.command(b'del ' + remote.encode('ascii'))
+        if sink is not None:
+            meta['stored'] = deliver(sink, data, meta)
+        return data, meta
+
+    # Shoot count images (or until the generator is closed), one every interval
+    # seconds or as fast as possible, and yield (data, meta) for each of them.
+    # Shot N+1 is stored on the camera while shot N is still being transferred,
+    # and the files on the camera are deleted in batches of deleteBatch
+    def stream(self, fmt='jpg', count=None, interval=0, sink=None, deleteBatch=8):
+        def transfer(remote):
+            start = time.perf_counter()
+            data = self.retrieveBytes(remote)
+            return data, time.perf_counter() - start
+        def finish(pending):
+            future, meta = pending
+            data, meta['transferTime'] = future.result()
+            meta['size'] = len(data)
+            done.append(meta['remote'])
+            if sink is not None:
+                meta['stored'] = deliver(sink, data, meta)
+            return data, meta
+        transfers = ThreadPoolExecutor(1)
+        pending = None
+        done = []
+        try:
+            start = time.monotonic()
+            for n in itertools.count():
+                if count is not None and n >= count:
+                    break
+                if n and interval:
+                    time.sleep(max(0, start + n * interval - time.monotonic()))
+                meta = self.store(fmt)
+                # The shot in flight is pending before the previous one is
+                # yielded, so that closing the generator there still waits
+                # for it and deletes it
+                previous, pending = pending, (transfers.submit(transfer, meta['remote']), meta)
+                if previous is not None:
+                    yield finish(previous)
+                if len(done) >= deleteBatch:
+                    self.deleteFiles(done)
+                    del done[:]
+            if pending is not None:
+                previous, pending = pending, None
+                yield finish(previous)
+        finally:
+            if pending is not None:
+                try:
+                    pending[0].result()
+                    done.append(pending[1]['remote'])
+                except (FLIRError, EOFError) + ftplib.all_errors as e:
+                    log.info("Transfer of " + pending[1]['remote'] + " failed: " + str(e))
+            transfers.shutdown()
+            if done:
+                try:
+                    self.deleteFiles(done)
+                except (FLIRError, EOFError, OSError) as e:
+                    # e.g. the session was closed after a timeout, do not hide that error
+                    log.info("%d file(s) left on the camera: %s" % (len(done), e))
+
+    # Shoot count images as fast as the camera can store them, then transfer
+    # them all in one FTP session, for short events such as a heating step.
+    # Without an interval, the store commands are sent in one write, so the
+    # camera never waits for the network between two shots. Returns a list of
+    # (data, meta) like capture(); meta['cameraTime'] is the capture time
+    # recorded by the camera [UTC], from the radiometric data or else from the
+    # FTP server. Shots whose store or transfer failed are left out and logged.
+    # A timeout ends the burst: the shots stored so far are still transferred
+    # and deleted, and so are the files of the stores that timed out, then the
+    # FLIRTimeout is raised
+    def burst(self, count, fmt='fff', interval=0, sink=None):
+        metas = []
+        abandoned = [] # remote names of stores that timed out, which may still complete
+        timeout = None
+        if interval:
+            start = time.monotonic()
+            for n in range(count):
+                time.sleep(max(0, start + n * interval - time.monotonic()))
+                remote = self.remoteName(fmt)
+                try:
+                    metas.append(self.store(fmt, remote))
+                except FLIRTimeout as e:
+                    log.info("Burst shot %d timed out, ending the burst: %s" % (n, e))
+                    abandoned.append(remote)
+                    timeout = e
+                    break
+                except FLIRError as e:
+                    log.info("Burst shot %d failed: %s" % (n, e))
+        else:
+            remotes = [self.remoteName(fmt) for n in range(count)]
+            stamps = []
+            begin = time.perf_counter()
+            try:
+                replies = self.pipeline([FORMATS[fmt][0] + r.encode('ascii') for r in remotes], 'store', stamps)
+            except FLIRTimeout as e:
+                # The stores that got their prompt are on the camera, their
+                # error replies are lost; the others may still complete
+                log.info("Burst timed out after %d of %d shots: %s" % (len(stamps), count, e))
+                replies = [None] * len(stamps)
+                abandoned = remotes[len(stamps):]
+                timeout = e
+            elapsed = time.perf_counter() - begin
+            for remote, reply, stamp in zip(remotes, replies, stamps):
+                if isinstance(reply, FLIRError):
+                    log.info("Burst shot " + remote + " failed: " + str(reply))
+                else:
+                    metas.append({'format': fmt, 'remote': remote, 'time': stamp, 'storeTime': elapsed / count})
+            log.info("Burst of %d shots stored in %.2f s (%.1f shots/s)" % (len(stamps), elapsed, len(stamps) / elapsed if elapsed else 0))
+        shots = []
+        done = []
+        try:
+            for meta in metas:
+                start = time.perf_counter()
+                try:
+                    data = self.retrieveBytes(meta['remote'])
+                except ftplib.all_errors as e:
+                    log.info("Transfer of " + meta['remote'] + " failed, left on the camera: " + str(e))
+                    continue
+                meta['transferTime'] = time.perf_counter() - start
+                meta['size'] = len(data)
+                meta['cameraTime'] = self.cameraTime(data, meta)
+                done.append(meta['remote'])
+                if sink is not None:
+                    meta['stored'] = deliver(sink, data, meta)
+                shots.append((data, meta))
+        finally:
+            if abandoned:
+                late = self.awaitFiles(abandoned)
+                if len(late) < len(abandoned):
+                    log.info("%d timed out shot(s) not found, they may appear on the camera later" % (len(abandoned) - len(late)))
+                done.extend(late)
+            if done:
+                if self.tn is None:
+                    self.connect() # the session was closed by the timeout
+                self.deleteFiles(done)
+        if timeout is not None:
+            raise timeout
+        return shots
+
+    # Wait for the files of stores that timed out, which the camera may still
+    # be writing. Keeps waiting as long as one of them appears within the store
+    # deadline. Returns those that are there
+    def awaitFiles(self, remotes):
+        wanted = set(remotes)
+        found = set()
+        deadline = time.monotonic() + self.timeouts['store']
+        while found != wanted and time.monotonic() < deadline:
+            try:
+                present = wanted.intersection(self.ftpSession().nlst())
+            except ftplib.all_errors as e:
+                log.info("Listing the camera files failed: " + str(e))
+                break
+            if present != found:
+                found = present
+                deadline = time.monotonic() + self.timeouts['store']
+            elif found != wanted:
+                time.sleep(0.05)
+        return [r for r in remotes if r in found]
+
+    # Capture time recorded by the camera in the radiometric data of a shot, or
+    # the modification time of its file on the camera
+    def cameraTime(self, data, meta):
+        try:
+            from functions import fff
+            buf = fff.fromJPEG(data) if meta['format'] == 'jpg' else data
+            info = fff.cameraInfo(buf, *fff.directory(buf)[fff.CAMERA_INFO])
+            if 'utcTime' in info:
+                return info['utcTime']
+        except (ImportError, ValueError, KeyError, struct.error):
+            pass
+        return self.fileTime(meta['remote'])
+
+    # Modification time of a file on the camera [UTC] from the FTP server, to
+    # the millisecond if the server reports it, or None
+    def fileTime(self, remote):
+        try:
+            stamp = self.ftpSession().sendcmd('MDTM ' + remote).split()[1]
+        except (ftplib.error_perm, IndexError):
+            return None
+        when = datetime.datetime.strptime(stamp[:14], '%Y%m%d%H%M%S')
+        if len(stamp) > 15:
+            when += datetime.timedelta(milliseconds=int(stamp[15:18].ljust(3, '0')))
+        return when
+
+    # Shoot image and transfer
+    def shootJPG(self,path): #TODO: OPTION TO SET PATH!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+        return self.capture('jpg', FileSink(path))[1]['stored']
+
     def shootFFF(self,path): #TODO: OPTION TO SET PATH!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
         # TODO infor: https://developer.flir.com/forums/topic/metadata-format/
-        # shoot the image and store it temporarily on the camera
-        self.tn.write(b'store temp.fff\n')
-        time.sleep(2)
-        # Set the filename for storage on the computer, with date/time info
-        filename = path + 'file-' + str(datetime.datetime.now().strftime('%Y%m%d-%H%M%S')) + '.fff'
-        # Transmit file from the camera through FTP
-        ftp = ftplib.FTP(self.host)
-        ftp.login()
-        ftp.cwd('/')
-        ftp.retrbinary('RETR ' + 'temp.fff', open(filename,'wb').write)
-        ftp.quit()
-        # After successful transmission of the file, delete it on the camera
-        self.tn.write(b'del temp.fff\n')
-        self.tn.read_until(b'>',1).decode('ascii')
-        return filename
+        return self.capture('fff', FileSink(path))[1]['stored']
 
     # Generic functions that allow more fine-grained, individual control of the camera
     def write(self,msg):
@@ -166,17 +723,36 @@ class FLIR(object):
             return False
 
     def close(self):
-        self.tn.write(b'exit\n')
-        self.tn.close()
+        self.ftpClose()
+        if self.tn is not None:
+            try:
+                self.tn.write(b'exit\n')
+            except OSError:
+                pass # the link is already gone
+            self.tn.close()
+            self.tn = None
         return True
 
 
+    # Send one shell command and return its reply, connecting first if needed
     def request(self,msg):
-        self.__init__()
-        self.connect()
-        if self.write(msg) == True :
-            self.close()
-            resp = self.read_all()
-            return resp
-        else :
-            return False
+        if self.tn is None:
+            self.connect()
+        return self.command(msg)
+
+# Setters for the resources that have one in functions.resources, e.g.
+# setRH(rh) [0.0-1.0], setDist(distance) [m], setAmbT(T) and setAtmT(T) [°C],
+# setEmiss(E) [0.001-1.0] and setPal(pal) with pal one of bw, iron, rainbow
+def setter(name):
+    def set(self, value):
+        return self.set(name, value)
+    set.__name__ = RESOURCES[name].setter
+    set.__doc__ = "Set " + RESOURCES[name].path + (" [" + RESOURCES[name].unit + "]" if RESOURCES[name].unit else "")
+    return set
+
+def addSetters(cls):
+    for name, resource in RESOURCES.items():
+        if resource.setter:
+            setattr(cls, resource.setter, setter(name))
+
+addSetters(FLIR)
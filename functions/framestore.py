@@ -0,0 +1,211 @@
+# Append-only container for thermal frames, instead of one small file per shot.
+#
+# name.frames holds a 64 byte header followed by fixed-size records:
+#   record header (32 bytes): magic, sequence number, timestamp, CRC32 of the rest
+#   calibration block: the camera info fields of fff.CAMERA_INFO_FIELDS as float64
+#   raw frame: height x width little-endian uint16
+# name.frames.idx holds (timestamp, offset) pairs, one per record, so that a
+# frame or a time range is found by binary search on the memory-mapped index.
+#
+# After a crash, a partly written record at the end of the file is cut off and
+# the index is rebuilt from the records when it does not match them.
+#
+#   store = FrameStore('site1.frames')
+#   cam.capture('fff', FrameStoreSink(store))
+#   T = store.frame(store.find(datetime.datetime(2017, 9, 3, 12))).temperature()
+
+import mmap, os, struct, zlib, datetime
+
+import numpy as np
+
+from functions import fff
+
+MAGIC = b'FLIRFRM1'
+RECORD_MAGIC = 0x43455246 # 'FREC'
+HEADER = struct.Struct('<8sIHHII')          # magic, version, height, width, record size, calibration fields
+HEADER_SIZE = 64
+RECORD = struct.Struct('<IIQdI')            # magic, reserved, sequence, timestamp, crc
+RECORD_SIZE = 32
+FIELDS = list(fff.CAMERA_INFO_FIELDS)
+CALIBRATION = struct.Struct('<%dd' % len(FIELDS))
+INDEX = np.dtype([('time', '<f8'), ('offset', '<u8')])
+
+class FrameStoreError(ValueError):
+    pass
+
+class FrameStore(object):
+    # Open or create path. shape (height, width) is only needed for a new store.
+    # With readonly, nothing is repaired or appended
+    def __init__(self, path, shape=None, readonly=False, syncEvery=0):
+        self.path = path
+        self.indexPath = path + '.idx'
+        self.readonly = readonly
+        self.syncEvery = syncEvery
+        self.unsynced = 0
+        self.map = None
+        self.indexMap = None
+        exists = os.path.exists(path) and os.path.getsize(path) >= HEADER_SIZE
+        if not exists:
+            if readonly or shape is None:
+                raise FrameStoreError(path + " does not exist")
+            self.create(shape)
+        self.file = open(path, 'rb' if readonly else 'r+b')
+        self.readHeader()
+        if not readonly:
+            self.recover()
+        self.index = open(self.indexPath, 'rb' if readonly else 'r+b')
+        self.remap()
+
+    def create(self, shape):
+        height, width = shape
+        size = RECORD_SIZE + CALIBRATION.size + height * width * 2
+        with open(self.path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, 1, height, width, size, len(FIELDS)).ljust(HEADER_SIZE, b'\0'))
+        open(self.indexPath, 'wb').close()
+
+    def readHeader(self):
+        magic, version, height, width, size, fields = HEADER.unpack(self.file.read(HEADER.size))
+        if magic != MAGIC or fields != len(FIELDS):
+            raise FrameStoreError(self.path + " is not a frame store of this version")
+        self.shape = (height, width)
+        self.recordSize = size
+
+    # Cut off a partly written record and make the index match the records
+    def recover(self):
+        size = os.path.getsize(self.path)
+        count = (size - HEADER_SIZE) // self.recordSize
+        # The last complete record may still be incomplete on disk if the
+        # crash happened between the writes of its parts
+        while count and not self.valid(count - 1):
+            count -= 1
+        end = HEADER_SIZE + count * self.recordSize
+        if end != size:
+            self.file.truncate(end)
+        if not os.path.exists(self.indexPath) or os.path.getsize(self.indexPath) != count * INDEX.itemsize:
+            self.rebuildIndex(count)
+
+    def valid(self, i):
+        self.file.seek(HEADER_SIZE + i * self.recordSize)
+        record = self.file.read(self.recordSize)
+        if len(record) < self.recordSize:
+            return False
+        magic, _, seq, t, crc = RECORD.unpack_from(record)
+        return magic == RECORD_MAGIC and crc == zlib.crc32(record[RECORD_SIZE:])
+
+    def rebuildIndex(self, count):
+        times = np.zeros(count, INDEX)
+        if count:
+            data = np.memmap(self.path, np.uint8, 'r', HEADER_SIZE, (count * self.recordSize,))
+            records = data.reshape(count, self.recordSize)
+            times['time'] = records[:, 16:24].copy().view('<f8')[:, 0]
+            del data, records
+        times['offset'] = HEADER_SIZE + np.arange(count, dtype=np.uint64) * self.recordSize
+        with open(self.indexPath, 'wb') as f:
+            f.write(times.tobytes())
+
+    # (Re)map the data and index files after they grew
+    def remap(self):
+        self.map = None
+        self.indexMap = None
+        self.count = (os.path.getsize(self.path) - HEADER_SIZE) // self.recordSize
+        if self.count:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.indexMap = mmap.mmap(self.index.fileno(), 0, access=mmap.ACCESS_READ)
+            self.times = np.frombuffer(self.indexMap, INDEX, self.count)['time']
+        else:
+            self.times = np.zeros(0)
+
+    def __len__(self):
+        return self.count
+
+    # Append one frame. raw is a (height, width) array of raw sensor values,
+    # info the camera info of fff.cameraInfo(), timestamp [s since 1970] or datetime
+    def append(self, raw, info, timestamp):
+        if self.readonly:
+            raise FrameStoreError(self.path + " is read-only")
+        if isinstance(timestamp, datetime.datetime):
+            timestamp = timestamp.timestamp()
+        if self.count and timestamp < self.lastTime():
+            raise FrameStoreError("timestamps must not decrease")
+        raw = np.asarray(raw)
+        if raw.shape != self.shape:
+            raise FrameStoreError("frame shape %s does not match the store %s" % (raw.shape, self.shape))
+        body = CALIBRATION.pack(*[float(info[f]) for f in FIELDS]) + raw.astype('<u2').tobytes()
+        record = RECORD.pack(RECORD_MAGIC, 0, self.count, timestamp, zlib.crc32(body)).ljust(RECORD_SIZE, b'\0') + body
+        offset = HEADER_SIZE + self.count * self.recordSize
+        self.file.seek(offset)
+        self.file.write(record)
+        self.file.flush()
+        # The index is written after the record, so it never points past the data
+        self.index.seek(self.count * INDEX.itemsize)
+        self.index.write(struct.pack('<dQ', timestamp, offset))
+        self.index.flush()
+        self.unsynced += 1
+        if self.syncEvery and self.unsynced >= self.syncEvery:
+            self.sync()
+        self.remap()
+        return self.count - 1
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+        os.fsync(self.index.fileno())
+        self.unsynced = 0
+
+    def lastTime(self):
+        return float(self.times[-1])
+
+    def offset(self, i):
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError("frame %d out of range" % i)
+        return HEADER_SIZE + i * self.recordSize
+
+    # Raw frame i as a view on the mapped file
+    def raw(self, i):
+        start = self.offset(i) + RECORD_SIZE + CALIBRATION.size
+        return np.frombuffer(self.map, '<u2', self.shape[0] * self.shape[1], start).reshape(self.shape)
+
+    def info(self, i):
+        values = CALIBRATION.unpack_from(self.map, self.offset(i) + RECORD_SIZE)
+        info = dict(zip(FIELDS, values))
+        info['planckO'] = int(info['planckO'])
+        info['time'] = datetime.datetime.fromtimestamp(self.time(i))
+        return info
+
+    def time(self, i):
+        return float(self.times[i])
+
+    def frame(self, i):
+        return fff.Frame(self.raw(i), self.info(i))
+
+    # Index of the first frame at or after t (seconds or datetime), O(log n)
+    def find(self, t):
+        if isinstance(t, datetime.datetime):
+            t = t.timestamp()
+        return int(np.searchsorted(self.times, t, 'left'))
+
+    # Indices of the frames from start (included) to end (excluded)
+    def between(self, start, end):
+        return range(self.find(start), self.find(end))
+
+    def close(self):
+        if not self.readonly and self.unsynced:
+            self.sync()
+        self.map = None
+        self.indexMap = None
+        self.times = None
+        self.file.close()
+        self.index.close()
+
+# Sink for FLIR.capture()/stream() with fmt='fff' (or radiometric 'jpg') that
+# appends every frame to a FrameStore instead of writing a file per shot
+class FrameStoreSink(object):
+    def __init__(self, store):
+        self.store = store
+
+    def __call__(self, data, meta):
+        if meta['format'] == 'jpg':
+            data = fff.fromJPEG(data)
+        frame = fff.read(data)
+        return self.store.append(frame.raw, frame.info, meta['time'])
@@ -0,0 +1,91 @@
+# Drops frames that hardly differ from the last frame that was kept, so that
+# long unattended runs do not fill the disk with copies of the same scene.
+# Each frame is reduced to block means of factor x factor pixels, in °C for
+# radiometric frames (.fff, or .jpg with temperature data), or in grey levels
+# for plain JPEG files (needs Pillow). The largest change of a block against
+# the last kept frame decides: a local event such as a warm spot survives the
+# averaging, sensor noise does not. Every keepEvery-th frame is kept in any
+# case, so that a static scene still leaves a trace.
+#
+#   gate = ChangeGate(FileSink('logs/'), threshold=0.5, keepEvery=10)
+#   cam.capture('jpg', gate)   # meta['stored'] is None for a dropped frame
+#
+# The frame still has to be transferred to be compared; the gate saves the
+# disk space and the work of everything behind the sink.
+
+import io
+
+import numpy as np
+
+from functions import fff
+
+import logging
+log = logging.getLogger('root')
+
+# Means of the factor x factor blocks of a 2D array, the edges that do not
+# fill a block are cut off
+def blockMean(a, factor):
+    h, w = a.shape[0] // factor, a.shape[1] // factor
+    return a[:h * factor, :w * factor].reshape(h, factor, w, factor).mean(axis=(1, 3), dtype=np.float32)
+
+class ChangeGate(object):
+    # threshold: change [°C] that makes a radiometric frame worth keeping,
+    # jpegThreshold: the same in grey levels for plain JPEG files
+    def __init__(self, sink, threshold=0.5, keepEvery=10, factor=8, jpegThreshold=8.0):
+        self.sink = sink
+        self.threshold = threshold
+        self.keepEvery = keepEvery
+        self.factor = factor
+        self.jpegThreshold = jpegThreshold
+        self.last = None
+        self.skipped = 0
+        self.stats = {'kept': 0, 'dropped': 0}
+        self.warned = False
+
+    # Reduced frame and the threshold that applies to it, or (None, None) if
+    # the frame cannot be compared
+    def signature(self, data, meta):
+        try:
+            buf = fff.fromJPEG(data) if meta['format'] == 'jpg' else data
+            records = fff.directory(buf)
+            raw = fff.rawImage(buf, *records[fff.RAW_DATA])
+            info = fff.cameraInfo(buf, *records[fff.CAMERA_INFO])
+            # Block means of the raw values, then only the small array is converted
+            return fff.temperature(blockMean(raw, self.factor), info), self.threshold
+        except (fff.FFFError, KeyError):
+            pass
+        if meta['format'] != 'jpg':
+            return None, None
+        try:
+            from PIL import Image
+        except ImportError:
+            if not self.warned:
+                log.warning("Pillow is not installed, plain JPEG frames are always kept")
+                self.warned = True
+            return None, None
+        image = Image.open(io.BytesIO(bytes(data)))
+        width = image.width
+        # draft() lets the JPEG decoder scale down by a power of two while
+        # decoding, the rest of the factor is averaged here
+        image.draft('L', (width // self.factor, image.height // self.factor))
+        grey = np.asarray(image.convert('L'), dtype=np.float32)
+        return blockMean(grey, max(1, self.factor * grey.shape[1] // width)), self.jpegThreshold
+
+    def __call__(self, data, meta):
+        signature, threshold = self.signature(data, meta)
+        if signature is None or self.last is None or signature.shape != self.last.shape:
+            change = None
+            keep = True
+        else:
+            change = float(np.abs(signature - self.last).max())
+            keep = change >= threshold or self.skipped + 1 >= self.keepEvery
+        meta['change'] = change
+        meta['kept'] = keep
+        if not keep:
+            self.skipped += 1
+            self.stats['dropped'] += 1
+            return None
+        self.last = signature
+        self.skipped = 0
+        self.stats['kept'] += 1
+        return self.sink(data, meta)
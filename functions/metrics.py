@@ -0,0 +1,100 @@
+# Latency histograms and event counters for the camera connection.
+# A histogram has fixed bucket bounds, so recording a duration is one binary
+# search and two additions, and the memory does not grow with the run time.
+#
+#   metrics = Metrics()
+#   metrics.observe('rset', 0.012)
+#   metrics.count('timeouts')
+#   metrics.snapshot()           # dict, e.g. for JSON or logging
+#   metrics.prometheus()         # text format of the Prometheus exposition
+#
+# Durations are in seconds.
+
+import bisect
+
+# Upper bounds [s] of the buckets, roughly log-spaced from 1 ms to 60 s
+BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 60)
+
+class Histogram(object):
+    def __init__(self, bounds=BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1) # the last bucket is +Inf
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.total += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    # Estimate of the p-th percentile, interpolated inside its bucket
+    def percentile(self, p):
+        if not self.total:
+            return 0.0
+        rank = self.total * p / 100.0
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                low = self.bounds[i - 1] if i else 0.0
+                high = self.bounds[i] if i < len(self.bounds) else self.max
+                return min(low + (high - low) * (rank - seen) / n, self.max)
+            seen += n
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.total,
+            'sum': self.sum,
+            'mean': self.sum / self.total if self.total else 0.0,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+        }
+
+class Metrics(object):
+    def __init__(self, bounds=BUCKETS):
+        self.bounds = bounds
+        self.histograms = {}
+        self.counters = {}
+
+    # Record the duration of one operation of the given phase
+    def observe(self, phase, seconds):
+        histogram = self.histograms.get(phase)
+        if histogram is None:
+            histogram = self.histograms.setdefault(phase, Histogram(self.bounds))
+        histogram.observe(seconds)
+
+    def count(self, event, n=1):
+        self.counters[event] = self.counters.get(event, 0) + n
+
+    def reset(self):
+        self.histograms = {}
+        self.counters = {}
+
+    def snapshot(self):
+        return {
+            'latency': dict((phase, h.snapshot()) for phase, h in sorted(self.histograms.items())),
+            'counters': dict(sorted(self.counters.items())),
+        }
+
+    # Prometheus text format. labels are added to every sample, e.g. {'camera': '192.168.1.10'}
+    def prometheus(self, labels=None, prefix='flir'):
+        def fmt(extra):
+            pairs = sorted((labels or {}).items()) + extra
+            return '{' + ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs) + '}'
+        lines = ['# TYPE %s_operation_seconds histogram' % prefix]
+        for phase, h in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, n in zip(list(h.bounds) + ['+Inf'], h.counts):
+                cumulative += n
+                lines.append('%s_operation_seconds_bucket%s %d' % (prefix, fmt([('phase', phase), ('le', bound)]), cumulative))
+            lines.append('%s_operation_seconds_sum%s %.6f' % (prefix, fmt([('phase', phase)]), h.sum))
+            lines.append('%s_operation_seconds_count%s %d' % (prefix, fmt([('phase', phase)]), h.total))
+        lines.append('# TYPE %s_events_total counter' % prefix)
+        for event, n in sorted(self.counters.items()):
+            lines.append('%s_events_total%s %d' % (prefix, fmt([('event', event)]), n))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,242 @@
+# Copy the files stored on the camera to a local folder over FTP, e.g. images
+# the camera stored on its own or files left behind by an interrupted run.
+# Only files that are not yet complete locally are downloaded, over several
+# FTP sessions at once if the camera accepts them. A download that breaks off
+# is kept as name.part and resumed with REST, by this run or the next one.
+# With --delete, a file is removed from the camera only after the local copy
+# was read back and its size and CRC32 match what was received.
+#
+# The downloaded files are listed in .mirror.jsonl in the output folder, one
+# JSON line per file, so the list survives crashes and costs one line per file.
+#
+#   python -m functions.mirror 192.168.1.10 --out backup --workers 4 --delete
+
+import argparse, fnmatch, ftplib, json, os, queue, sys, threading, time, zlib
+
+import logging
+log = logging.getLogger('root')
+
+MANIFEST = '.mirror.jsonl'
+BLOCK = 65536
+
+# CRC32 of a local file, from offset 0 to its end
+def fileCRC(path):
+    crc = 0
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK), b''):
+            crc = zlib.crc32(block, crc)
+    return crc
+
+def closeSession(ftp):
+    try:
+        ftp.quit()
+    except ftplib.all_errors:
+        ftp.close()
+
+class Mirror(object):
+    def __init__(self, host, out, port=21, workers=4, remoteDir='/', pattern='*', timeout=10):
+        self.host = host
+        self.port = port
+        self.out = out
+        self.workers = workers
+        self.remoteDir = remoteDir
+        self.pattern = pattern
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.manifestPath = os.path.join(out, MANIFEST)
+        os.makedirs(out, exist_ok=True)
+        self.manifest = self.readManifest()
+        self.stats = {'files': 0, 'bytes': 0, 'resumed': 0, 'failed': 0, 'deleted': 0, 'sessions': 0}
+
+    def readManifest(self):
+        manifest = {}
+        if os.path.exists(self.manifestPath):
+            with open(self.manifestPath) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue # a line cut off by a crash
+                    manifest[entry['name']] = entry
+        return manifest
+
+    def record(self, entry):
+        with self.lock:
+            self.manifest[entry['name']] = entry
+            with open(self.manifestPath, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+
+    def session(self):
+        ftp = ftplib.FTP()
+        ftp.connect(self.host, self.port, self.timeout)
+        ftp.login()
+        ftp.cwd(self.remoteDir)
+        ftp.voidcmd('TYPE I')
+        return ftp
+
+    # {name: size} of the files on the camera
+    def listRemote(self, ftp):
+        names = [n for n in ftp.nlst() if fnmatch.fnmatch(n, self.pattern)]
+        return dict((n, ftp.size(n)) for n in names)
+
+    def local(self, name):
+        return os.path.join(self.out, name)
+
+    # True if name is in the manifest with this size and its file is there
+    def complete(self, name, size):
+        entry = self.manifest.get(name)
+        if entry is None or entry['size'] != size:
+            return False
+        try:
+            return os.path.getsize(self.local(name)) == size
+        except OSError:
+            return False
+
+    # Download one file, resuming a .part file that is left from before
+    def download(self, ftp, name, size):
+        part = self.local(name) + '.part'
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        if size is not None and offset > size:
+            offset = 0
+        crc = fileCRC(part) if offset else 0
+        if offset:
+            with self.lock:
+                self.stats['resumed'] += 1
+        state = {'crc': crc, 'received': offset}
+        with open(part, 'r+b' if offset else 'wb') as f:
+            f.seek(offset)
+            f.truncate()
+            def receive(block):
+                f.write(block)
+                state['crc'] = zlib.crc32(block, state['crc'])
+                state['received'] += len(block)
+            ftp.retrbinary('RETR ' + name, receive, BLOCK, rest=offset or None)
+        if size is not None and state['received'] != size:
+            raise ftplib.error_temp("%s: received %d of %d bytes" % (name, state['received'], size))
+        os.replace(part, self.local(name))
+        self.record({'name': name, 'size': state['received'], 'crc': state['crc'], 'time': time.time()})
+        with self.lock:
+            self.stats['files'] += 1
+            self.stats['bytes'] += state['received'] - offset
+
+    # One FTP session working through the queue. If the camera refuses another
+    # session, the worker ends and the others carry on with its share; run()
+    # only counts that as a failure if no worker got a session at all
+    def worker(self, jobs, failures, refused):
+        try:
+            ftp = self.session()
+        except ftplib.all_errors as e:
+            log.info("Camera refused an FTP session (%s), continuing with fewer" % e)
+            refused.append(e)
+            return
+        with self.lock:
+            self.stats['sessions'] += 1
+        try:
+            while True:
+                try:
+                    name, size = jobs.get_nowait()
+                except queue.Empty:
+                    return
+                for attempt in range(2):
+                    try:
+                        self.download(ftp, name, size)
+                        break
+                    except ftplib.error_perm as e:
+                        failures.append((name, e))
+                        break
+                    except ftplib.all_errors as e:
+                        if attempt:
+                            failures.append((name, e))
+                            break
+                        # Open a new session and resume from the .part file
+                        log.info("Transfer of %s broke off (%s), resuming" % (name, e))
+                        ftp.close()
+                        try:
+                            ftp = self.session()
+                        except ftplib.all_errors as e:
+                            failures.append((name, e))
+                            return
+        finally:
+            closeSession(ftp)
+
+    # True if the local copy of name still has the size and CRC32 recorded
+    # when it was downloaded, and the size of the file on the camera
+    def verify(self, name, size):
+        entry = self.manifest.get(name)
+        if entry is None or entry['size'] != size:
+            return False
+        path = self.local(name)
+        try:
+            return os.path.getsize(path) == size and fileCRC(path) == entry['crc']
+        except OSError:
+            return False
+
+    # Delete the verified files on the camera, batch at a time
+    def deleteVerified(self, ftp, remote, batch):
+        names = sorted(remote)
+        for first in range(0, len(names), batch):
+            verified = [n for n in names[first:first + batch] if self.verify(n, remote[n])]
+            for name in verified:
+                try:
+                    ftp.delete(name)
+                    self.stats['deleted'] += 1
+                except ftplib.error_perm as e:
+                    log.warning("Deleting %s failed: %s" % (name, e))
+            skipped = len(names[first:first + batch]) - len(verified)
+            if skipped:
+                log.warning("%d file(s) kept on the camera, their local copy did not verify" % skipped)
+
+    # List, download what is missing and optionally delete. Returns the stats.
+    # The listing session is closed before the workers start, so that a camera
+    # that allows a single FTP session still serves the first worker
+    def run(self, delete=False, batch=16):
+        start = time.perf_counter()
+        ftp = self.session()
+        try:
+            remote = self.listRemote(ftp)
+        finally:
+            closeSession(ftp)
+        todo = [(n, s) for n, s in sorted(remote.items()) if not self.complete(n, s)]
+        log.info("%d file(s) on the camera, %d to download" % (len(remote), len(todo)))
+        jobs = queue.Queue()
+        for job in todo:
+            jobs.put(job)
+        failures = []
+        refused = []
+        threads = [threading.Thread(target=self.worker, args=(jobs, failures, refused))
+                   for i in range(max(1, min(self.workers, len(todo))))] if todo else []
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if threads and not self.stats['sessions']:
+            failures.append(('session', refused[-1]))
+        for name, error in failures:
+            log.warning("%s failed: %s" % (name, error))
+        self.stats['failed'] = len(failures)
+        if delete:
+            # A new session, the first one would have sat idle during the downloads
+            ftp = self.session()
+            try:
+                self.deleteVerified(ftp, remote, batch)
+            finally:
+                closeSession(ftp)
+        self.stats['seconds'] = time.perf_counter() - start
+        return self.stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Copy the files stored on a FLIR A320 to a local folder")
+    parser.add_argument('host')
+    parser.add_argument('--out', default='.', help="output folder")
+    parser.add_argument('--port', type=int, default=21)
+    parser.add_argument('--dir', default='/', help="folder on the camera")
+    parser.add_argument('--pattern', default='*', help="only files matching this, e.g. *.fff")
+    parser.add_argument('--workers', type=int, default=4, help="parallel FTP sessions")
+    parser.add_argument('--delete', action='store_true', help="delete verified files on the camera")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)8s %(module)15s: %(message)s')
+    stats = Mirror(args.host, args.out, args.port, args.workers, args.dir, args.pattern).run(args.delete)
+    log.info("%d file(s), %.1f MB in %.1f s over %d session(s), %d resumed, %d failed, %d deleted" % (
+        stats['files'], stats['bytes'] / 1e6, stats['seconds'], stats['sessions'], stats['resumed'],
+        stats['failed'], stats['deleted']))
+    sys.exit(1 if stats['failed'] else 0)
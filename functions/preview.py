@@ -0,0 +1,65 @@
+# Preview decoding for the GUI. JPEG decoding and scaling run in their own
+# thread; only the conversion to a QPixmap, which Qt allows on the GUI thread
+# only, is left to the caller. A frame that is still waiting to be decoded when
+# a newer one arrives is dropped. The last scaled frames are kept in a small
+# LRU cache so that the operator can step back through them without decoding.
+
+from collections import OrderedDict
+
+from PyQt5 import QtCore, QtGui
+
+class PreviewWorker(QtCore.QObject):
+    ready = QtCore.pyqtSignal(int, object, QtGui.QImage) # shot number, meta, scaled image
+    decodeRequest = QtCore.pyqtSignal(int, object, object)
+
+    def __init__(self, width=640, height=480, parent=None):
+        QtCore.QObject.__init__(self, parent)
+        self.width = width
+        self.height = height
+        self.latest = 0
+        self.decodeRequest.connect(self.decode)
+
+    # Called from the GUI thread with the JPEG data of shot number key
+    def submit(self, key, data, meta):
+        self.latest = key
+        self.decodeRequest.emit(key, data, meta)
+
+    @QtCore.pyqtSlot(int, object, object)
+    def decode(self, key, data, meta):
+        # Skip frames that are already stale
+        if key != self.latest:
+            return
+        image = QtGui.QImage.fromData(bytes(data))
+        if key != self.latest:
+            return
+        image = image.scaled(self.width, self.height, aspectRatioMode=QtCore.Qt.KeepAspectRatio, transformMode=QtCore.Qt.SmoothTransformation) # To scale image for example and keep its Aspect Ration
+        self.ready.emit(key, meta, image)
+
+# The last size previews, by shot number
+class PreviewCache(object):
+    def __init__(self, size=20):
+        self.size = size
+        self.items = OrderedDict()
+
+    def put(self, key, value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+        while len(self.items) > self.size:
+            self.items.popitem(last=False)
+
+    def get(self, key):
+        value = self.items.get(key)
+        if value is not None:
+            self.items.move_to_end(key)
+        return value
+
+    def keys(self):
+        return sorted(self.items)
+
+    # Key next to key in direction step (-1: older, 1: newer), or None
+    def neighbour(self, key, step):
+        keys = self.keys()
+        if key not in keys:
+            return keys[-1] if keys else None
+        i = keys.index(key) + step
+        return keys[i] if 0 <= i < len(keys) else None
@@ -0,0 +1,97 @@
+# Registry of the camera resources used by this program: the path in the
+# configuration tree of the A320 shell, the type and unit of the value, and its
+# valid range. Values are checked and converted here before they are sent with
+# rset, and replies of rget are turned back into typed values, so that
+# FLIR.set('emiss', 0.95) and FLIR.get('emiss') work the same for every resource.
+#
+#   RESOURCES['atmT'].encode(20)        # '293.15', the camera works in Kelvin
+#   RESOURCES['atmT'].decode('293.15')  # 20.0
+#   RESOURCES['emiss'].encode(1.5)      # ResourceError: out of range
+
+# Raised for a value that does not fit the type or range of its resource
+class ResourceError(ValueError):
+    pass
+
+TRUE = ('true', '1', 'on', 'yes')
+FALSE = ('false', '0', 'off', 'no')
+
+class Resource(object):
+    # kind: 'float', 'bool' or 'choice'. offset is added to the value before
+    # it is sent (°C to K). cached is False for actions such as the autofocus,
+    # which must be sent every time. command selects the deadline in FLIR.timeouts
+    def __init__(self, path, kind, unit='', low=None, high=None, choices=None, quote=False,
+                 offset=0.0, cached=True, command='default', setter=None):
+        self.path = path
+        self.kind = kind
+        self.unit = unit
+        self.low = low
+        self.high = high
+        self.choices = choices
+        self.quote = quote
+        self.offset = offset
+        self.cached = cached
+        self.command = command
+        self.setter = setter
+
+    # Value text for rset
+    def encode(self, value):
+        if self.kind == 'bool':
+            if isinstance(value, str):
+                value = self.decode(value)
+            return 'true' if value else 'false'
+        if self.kind == 'choice':
+            if value not in self.choices:
+                raise ResourceError("%s must be one of %s, not %r" % (self.path, ', '.join(self.choices), value))
+            return '"%s"' % value if self.quote else value
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            raise ResourceError("%s needs a number, not %r" % (self.path, value))
+        if (self.low is not None and number < self.low) or (self.high is not None and number > self.high):
+            unit = ' ' + self.unit if self.unit else ''
+            raise ResourceError("%s must be between %g%s and %g%s, not %g" % (self.path, self.low, unit, self.high, unit, number))
+        return repr(round(number + self.offset, 6))
+
+    # Typed value from the text of an rget reply
+    def decode(self, text):
+        text = text.strip().strip('"')
+        if self.kind == 'bool':
+            if text.lower() in TRUE:
+                return True
+            if text.lower() in FALSE:
+                return False
+            raise ResourceError("%s: %r is not a boolean" % (self.path, text))
+        if self.kind == 'choice':
+            return text
+        try:
+            return float(text) - self.offset
+        except ValueError:
+            raise ResourceError("%s: %r is not a number" % (self.path, text))
+
+OBJECT = '.image.sysimg.basicImgData.objectParams.'
+
+# By the short name used in FLIR.set(), FLIR.applyParams() and the config
+# files. setter is the name of the FLIR method generated for the resource
+RESOURCES = {
+    'rh': Resource(OBJECT + 'relHum', 'float', '', 0.0, 1.0, setter='setRH'),
+    'dist': Resource(OBJECT + 'objectDistance', 'float', 'm', 0.0, 10000.0, setter='setDist'),
+    'ambT': Resource(OBJECT + 'ambTemp', 'float', '°C', -100.0, 1000.0, offset=273.15, setter='setAmbT'),
+    'atmT': Resource(OBJECT + 'atmTemp', 'float', '°C', -100.0, 200.0, offset=273.15, setter='setAtmT'),
+    'emiss': Resource(OBJECT + 'emissivity', 'float', '', 0.001, 1.0, setter='setEmiss'),
+    'pal': Resource('.image.sysimg.palette.readFile', 'choice', choices=('bw', 'iron', 'rainbow'), setter='setPal'),
+    'format': Resource('.image.services.store.format', 'choice', choices=('JPEG', 'JPEG+PNG'), quote=True),
+    'overlay': Resource('.image.services.store.overlay', 'bool'),
+    'hideGraphics': Resource('.gui.system.hideGraphics', 'bool'),
+    'autofast': Resource('.system.focus.autofast', 'bool', cached=False, command='focus'),
+    'autofull': Resource('.system.focus.autofull', 'bool', cached=False, command='focus'),
+}
+
+BY_PATH = dict((r.path, r) for r in RESOURCES.values())
+
+# Typed value of an rget reply for the resource at path. Paths that are not in
+# the registry are returned as text
+def parseValue(path, text):
+    resource = BY_PATH.get(path)
+    if resource is None:
+        return text.strip()
+    return resource.decode(text)
@@ -0,0 +1,196 @@
+# Temperature statistics for fixed regions of interest (ROI).
+# The regions are turned into flat pixel indices once. The statistics of all
+# regions are then computed for a frame, or a whole stack of frames, with a
+# few NumPy calls and no loop over pixels or regions.
+#
+#   rois = ROISet((240, 320))
+#   rois.rect('leaf', 100, 80, 140, 120)         # x0, y0, x1, y1 (exclusive)
+#   rois.polygon('stem', [(10, 10), (60, 12), (30, 70)])
+#   stats = rois.compute(T)                      # T: (240, 320) or (n, 240, 320)
+#
+# Regions can also be read from a JSON file:
+#   {"leaf": {"rect": [100, 80, 140, 120]}, "stem": {"polygon": [[10, 10], [60, 12], [30, 70]]}}
+#
+#   python -m functions.roi rois.json logs --out roi.csv
+
+import argparse, csv, json, os
+
+import numpy as np
+
+from functions import fff
+
+class ROISet(object):
+    def __init__(self, shape, percentiles=(5, 50, 95)):
+        self.shape = tuple(shape)
+        self.percentiles = tuple(percentiles)
+        self.names = []
+        self.regions = []
+        self.prepared = None
+
+    @classmethod
+    def fromDict(cls, shape, regions, percentiles=(5, 50, 95)):
+        rois = cls(shape, percentiles)
+        for name, region in regions.items():
+            if 'rect' in region:
+                rois.rect(name, *region['rect'])
+            elif 'polygon' in region:
+                rois.polygon(name, region['polygon'])
+            else:
+                raise ValueError("ROI " + name + " needs a rect or a polygon")
+        return rois
+
+    @classmethod
+    def load(cls, filename, shape, percentiles=(5, 50, 95)):
+        with open(filename) as f:
+            return cls.fromDict(shape, json.load(f), percentiles)
+
+    def add(self, name, flat):
+        if len(flat) == 0:
+            raise ValueError("ROI " + name + " contains no pixels")
+        self.names.append(name)
+        self.regions.append(np.asarray(flat, dtype=np.intp))
+        self.prepared = None
+
+    # Rectangle from (x0, y0) to (x1, y1), x1 and y1 excluded
+    def rect(self, name, x0, y0, x1, y1):
+        height, width = self.shape
+        ys, xs = np.mgrid[max(y0, 0):min(y1, height), max(x0, 0):min(x1, width)]
+        self.add(name, (ys * width + xs).ravel())
+
+    # Polygon with the vertices [(x, y), ...]. A pixel belongs to it if its
+    # centre is inside (even-odd rule), tested for all pixels of the bounding
+    # box at once
+    def polygon(self, name, points):
+        height, width = self.shape
+        pts = np.asarray(points, dtype=float)
+        x0, y0 = np.floor(pts.min(axis=0)).astype(int).clip(0)
+        x1 = min(int(np.ceil(pts[:, 0].max())) + 1, width)
+        y1 = min(int(np.ceil(pts[:, 1].max())) + 1, height)
+        ys, xs = np.mgrid[y0:y1, x0:x1]
+        px, py = xs.ravel() + 0.5, ys.ravel() + 0.5
+        inside = np.zeros(px.shape, bool)
+        for (ax, ay), (bx, by) in zip(pts, np.roll(pts, -1, axis=0)):
+            crosses = (ay > py) != (by > py)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                xcross = ax + (py - ay) * (bx - ax) / (by - ay)
+            inside ^= crosses & (px < xcross)
+        self.add(name, (ys.ravel() * width + xs.ravel())[inside])
+
+    # Boolean mask of the shape of the frames
+    def mask(self, name, mask):
+        self.add(name, np.flatnonzero(np.asarray(mask).ravel()))
+
+    # Concatenated indices of all regions and where each region starts
+    def prepare(self):
+        if self.prepared is None:
+            sizes = np.array([len(r) for r in self.regions])
+            starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+            segment = np.repeat(np.arange(len(sizes)), sizes)
+            self.prepared = (np.concatenate(self.regions), starts, sizes, segment)
+        return self.prepared
+
+    # Statistics of every region. frames is one frame or a stack of frames.
+    # Returns {'min', 'max', 'mean', 'p5', ...: array of (regions,) or (frames, regions)}.
+    # Non-finite pixels (fff.temperature gives NaN for dead pixels) are left
+    # out; a region without a finite pixel gets NaN
+    def compute(self, frames):
+        flat, starts, sizes, segment = self.prepare()
+        frames = np.asarray(frames)
+        single = frames.ndim == 2
+        values = frames.reshape(1 if single else frames.shape[0], -1)[:, flat].astype(np.float64)
+        finite = np.isfinite(values)
+        counts = np.add.reduceat(finite, starts, axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            stats = {'mean': np.add.reduceat(np.where(finite, values, 0.0), starts, axis=1) / counts}
+        # Sort inside every region at once: shifting each region by a multiple of
+        # the value span keeps the regions apart in a single sort per frame.
+        # Non-finite values are put behind the finite ones of their region
+        low = np.where(finite, values, np.inf).min(axis=1, keepdims=True)
+        high = np.where(finite, values, -np.inf).max(axis=1, keepdims=True)
+        low[~np.isfinite(low)] = 0.0 # no finite value in the frame
+        span = np.maximum(high - low, 0.0) + 1
+        ordered = np.sort(np.where(finite, values - low, span - 0.5) + segment * span, axis=1) - segment * span + low
+        last = np.maximum(counts - 1, 0)
+        empty = counts == 0
+        def at(pos):
+            picked = np.take_along_axis(ordered, starts + pos, axis=1)
+            picked[empty] = np.nan
+            return picked
+        stats['min'] = at(np.zeros_like(last))
+        stats['max'] = at(last)
+        for p in self.percentiles:
+            pos = last * (p / 100.0)
+            below = np.floor(pos).astype(np.intp)
+            above = np.minimum(below + 1, last)
+            frac = pos - below
+            stats['p%g' % p] = at(below) * (1 - frac) + at(above) * frac
+        if single:
+            stats = dict((k, v[0]) for k, v in stats.items())
+        return stats
+
+    def columns(self):
+        keys = ['min', 'max', 'mean'] + ['p%g' % p for p in self.percentiles]
+        return [(n, k) for n in self.names for k in keys]
+
+# Writes one CSV row per frame: time, then every statistic of every region
+class ROIWriter(object):
+    def __init__(self, filename, rois):
+        self.rois = rois
+        exists = os.path.exists(filename) and os.path.getsize(filename) > 0
+        self.keys = [k for n, k in rois.columns()]
+        self.index = [rois.names.index(n) for n, k in rois.columns()]
+        self.file = open(filename, 'a', newline='')
+        self.writer = csv.writer(self.file)
+        if not exists:
+            self.writer.writerow(['time'] + [n + '_' + k for n, k in rois.columns()])
+
+    # times is one time or a list of times, matching stats of one or more frames
+    def write(self, times, stats):
+        if not isinstance(times, (list, tuple)):
+            times = [times]
+            stats = dict((k, v[np.newaxis]) for k, v in stats.items())
+        for i, t in enumerate(times):
+            row = ['%.3f' % stats[k][i, j] for k, j in zip(self.keys, self.index)]
+            self.writer.writerow([t.isoformat() if hasattr(t, 'isoformat') else t] + row)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+# Sink for FLIR.capture()/stream() that logs the ROI statistics of every
+# radiometric frame (.fff, or .jpg with temperature data) as it is captured
+class ROISink(object):
+    def __init__(self, rois, writer):
+        self.rois = rois
+        self.writer = writer
+
+    def __call__(self, data, meta):
+        if meta['format'] == 'jpg':
+            data = fff.fromJPEG(data)
+        frame = fff.read(data)
+        stats = self.rois.compute(frame.temperature())
+        self.writer.write(frame.time or meta['time'], stats)
+        return stats
+
+# ROI statistics of every frame of an FFFArchive, batch frames at a time
+def processArchive(archive, rois, writer, batch=64):
+    for first in range(0, len(archive), batch):
+        indices = range(first, min(first + batch, len(archive)))
+        T = np.stack([archive.temperature(i) for i in indices])
+        times = [archive.info(i).get('time') or os.path.basename(archive.paths[i]) for i in indices]
+        writer.write(times, rois.compute(T))
+
+if __name__ == "__main__":
+    from functions.archive import FFFArchive
+    parser = argparse.ArgumentParser(description="ROI temperature statistics of a folder of .fff files")
+    parser.add_argument('rois', help="JSON file with the regions")
+    parser.add_argument('folder')
+    parser.add_argument('--out', default='roi.csv')
+    args = parser.parse_args()
+    archive = FFFArchive(args.folder)
+    if len(archive):
+        rois = ROISet.load(args.rois, archive.raw(0).shape)
+        writer = ROIWriter(args.out, rois)
+        processArchive(archive, rois, writer)
+        writer.close()
+    archive.close()
@@ -0,0 +1,111 @@
+# Interval scheduling aimed at absolute wall-clock deadlines.
+# Slot n is due at origin + n * interval, however long the previous shots took,
+# so the cadence does not drift. Slots that have passed while a shot was still
+# running are counted as missed instead of being shot back to back.
+#
+#   sched = DeadlineScheduler(60)
+#   while True:
+#       time.sleep(sched.delay())
+#       slot = sched.due()
+#       if slot is not None:
+#           shoot()
+
+import time
+
+class DeadlineScheduler(object):
+    # interval [s] between slots. A slot served more than tolerance [s] after its
+    # deadline counts as late (default: a tenth of the interval). With align,
+    # the deadlines fall on multiples of the interval, e.g. on the full minute
+    def __init__(self, interval, tolerance=None, align=False, clock=time.time):
+        self.interval = float(interval)
+        self.tolerance = tolerance
+        self.align = align
+        self.clock = clock
+        self.start()
+
+    def start(self, now=None):
+        if now is None:
+            now = self.clock()
+        if self.align:
+            now = (now // self.interval + 1) * self.interval
+        self.origin = now
+        self.next = 0
+        self.fired = 0
+        self.missed = 0
+        self.late = 0
+        self.maxLateness = 0.0
+        # Shots served since the interval was last set, for the achieved cadence
+        self.served = 0
+        self.first = None
+        self.last = None
+
+    # Deadline of slot n
+    def deadline(self, n):
+        return self.origin + n * self.interval
+
+    # Seconds until the next slot is due
+    def delay(self, now=None):
+        if now is None:
+            now = self.clock()
+        return max(0.0, self.deadline(self.next) - now)
+
+    # Call when woken up for a slot. Returns None if no slot is due yet, else a
+    # dict with the slot number, its deadline, how late it is served [s] and how
+    # many slots were missed since the last one. If the caller is still busy
+    # with the previous shot, the due slot is counted as missed and None returned
+    def due(self, now=None, busy=False):
+        if now is None:
+            now = self.clock()
+        n = int((now - self.origin) // self.interval)
+        if n < self.next:
+            return None
+        missed = n - self.next
+        if busy:
+            self.next = n + 1
+            self.missed += missed + 1
+            return None
+        lateness = now - self.deadline(n)
+        tolerance = self.interval / 10 if self.tolerance is None else self.tolerance
+        self.next = n + 1
+        self.fired += 1
+        self.missed += missed
+        if lateness > tolerance:
+            self.late += 1
+        self.maxLateness = max(self.maxLateness, lateness)
+        if self.first is None:
+            self.first = now
+        self.last = now
+        self.served += 1
+        return {'slot': n, 'deadline': self.deadline(n), 'lateness': lateness, 'missed': missed}
+
+    # Change the interval without restarting. The next deadline is one new
+    # interval after the last served slot
+    def setInterval(self, interval, now=None):
+        if now is None:
+            now = self.clock()
+        if self.next:
+            origin = self.deadline(self.next - 1)
+        else:
+            origin = self.deadline(0) - float(interval)
+        self.interval = float(interval)
+        # Keep the slot numbers, only move the origin
+        self.origin = origin - (self.next - 1) * self.interval
+        # Don't report the slots in between as missed
+        if self.deadline(self.next) < now:
+            self.next = int((now - self.origin) // self.interval) + 1
+        self.served = 0
+        self.first = None
+
+    # Requested versus achieved cadence
+    def stats(self):
+        achieved = None
+        if self.served > 1:
+            achieved = (self.last - self.first) / (self.served - 1)
+        return {
+            'interval': self.interval,
+            'achievedInterval': achieved,
+            'fired': self.fired,
+            'missed': self.missed,
+            'late': self.late,
+            'maxLateness': self.maxLateness,
+        }
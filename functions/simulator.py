@@ -0,0 +1,421 @@
+# Local stand-in for a FLIR A320, to run and measure the software without a
+# camera. It speaks the part of the telnet shell used by functions.flir
+# (rset, rget, store, store -j, del, date, time, exit, with the msc]/> prompts)
+# and serves the stored images over FTP (passive mode). The images are
+# synthetic: .fff files with a raw frame and camera info, and JPEG files that
+# carry the same data in FLIR APP1 segments, so the radiometric readers work.
+# Latencies and failures can be configured.
+#
+#   sim = Simulator(latency={'store': 0.3})
+#   sim.start()
+#   cam = sim.camera()      # functions.flir.FLIR connected to the simulator
+#   ...
+#   sim.stop()
+#
+#   python -m functions.simulator --telnet-port 2323 --ftp-port 2121
+
+import argparse, array, math, random, socket, socketserver, struct, threading, time, datetime
+
+import logging
+log = logging.getLogger('root')
+
+# Default latencies [s] of the simulated camera
+LATENCY = {
+    'command': 0.002,   # any shell command
+    'store': 0.25,      # store of an .fff file
+    'storeJpg': 0.35,   # store -j
+    'focus': 0.5,       # rset .system.focus.*
+    'ftpLogin': 0.01,
+    'bandwidth': 0,     # FTP transfer rate [bytes/s], 0: unlimited
+}
+
+# Default failure probabilities per operation
+FAILURES = {
+    'drop': 0.0,        # telnet connection closed instead of answering
+    'error': 0.0,       # shell command answered with an error
+    'ftpDrop': 0.0,     # FTP transfer aborted halfway
+}
+
+# Camera info of the synthetic .fff files, see functions.fff.CAMERA_INFO_FIELDS
+CAMERA_INFO = [
+    (0x20, 'f', 'emissivity', 0.95),
+    (0x24, 'f', 'objectDistance', 1.0),
+    (0x28, 'f', 'reflectedTemp', 293.15),
+    (0x2c, 'f', 'atmosphericTemp', 293.15),
+    (0x30, 'f', 'irWindowTemp', 293.15),
+    (0x34, 'f', 'irWindowTransmission', 1.0),
+    (0x3c, 'f', 'relativeHumidity', 0.5),
+    (0x58, 'f', 'planckR1', 14906.2),
+    (0x5c, 'f', 'planckB', 1396.5),
+    (0x60, 'f', 'planckF', 1.0),
+    (0x70, 'f', 'atmTransAlpha1', 0.006569),
+    (0x74, 'f', 'atmTransAlpha2', 0.01262),
+    (0x78, 'f', 'atmTransBeta1', -0.002276),
+    (0x7c, 'f', 'atmTransBeta2', -0.00667),
+    (0x80, 'f', 'atmTransX', 1.9),
+    (0x308, 'i', 'planckO', -7261),
+    (0x30c, 'f', 'planckR2', 0.0125),
+]
+
+# Resources known to the shell, with their initial values
+RESOURCES = {
+    '.image.sysimg.basicImgData.objectParams.relHum': '0.5',
+    '.image.sysimg.basicImgData.objectParams.objectDistance': '1.0',
+    '.image.sysimg.basicImgData.objectParams.ambTemp': '293.15',
+    '.image.sysimg.basicImgData.objectParams.atmTemp': '293.15',
+    '.image.sysimg.basicImgData.objectParams.emissivity': '0.95',
+    '.image.sysimg.palette.readFile': 'iron',
+    '.image.services.store.format': '"JPEG+PNG"',
+    '.image.services.store.overlay': 'true',
+    '.gui.system.hideGraphics': 'false',
+    '.system.focus.autofast': 'false',
+    '.system.focus.autofull': 'false',
+}
+
+# A synthetic .fff file: a vertical gradient with a warm spot that moves with
+# time, built row by row so that it costs little next to the store latency
+def makeFFF(width=320, height=240, when=None, params=None, rng=random):
+    when = time.time() if when is None else when
+    phase = when / 10.0
+    cx = int(width / 2 + width / 4 * math.cos(phase))
+    cy = int(height / 2 + height / 4 * math.sin(phase))
+    noise = rng.randrange(16)
+    raw = array.array('H')
+    for y in range(height):
+        row = array.array('H', [15000 + 10 * y + noise]) * width
+        half = int(math.sqrt(max(400 - (y - cy) ** 2, 0)))
+        if half:
+            x0, x1 = max(cx - half, 0), min(cx + half, width)
+            row[x0:x1] = array.array('H', [18000 + noise]) * (x1 - x0)
+        raw.extend(row)
+    if struct.pack('=H', 1) != struct.pack('<H', 1):
+        raw.byteswap()
+    rawRecord = struct.pack('<HHH', 2, width, height).ljust(0x20, b'\0') + raw.tobytes()
+    info = bytearray(0x400)
+    struct.pack_into('<H', info, 0, 2)
+    for offset, fmt, name, value in CAMERA_INFO:
+        if params and name in params:
+            value = params[name]
+        struct.pack_into('<' + fmt, info, offset, value)
+    struct.pack_into('<IIh', info, 0x384, int(when), int(when * 1000) % 1000, 0)
+    header = bytearray(0x40)
+    header[:4] = b'FFF\0'
+    header[4:20] = b'A320 simulator'.ljust(16, b'\0')
+    struct.pack_into('>III', header, 0x14, 100, 0x40, 2)
+    rawOffset = 0x40 + 2 * 0x20
+    infoOffset = rawOffset + len(rawRecord)
+    directory = (struct.pack('>HHIIII', 0x01, 0, 100, 1, rawOffset, len(rawRecord)).ljust(0x20, b'\0')
+                 + struct.pack('>HHIIII', 0x20, 0, 100, 2, infoOffset, len(info)).ljust(0x20, b'\0'))
+    return bytes(header) + directory + rawRecord + bytes(info)
+
+# A JPEG file carrying fffData in FLIR APP1 segments. The image part is a
+# minimal placeholder, it is not meant to be displayed
+def makeJPEG(fffData, segment=65000):
+    parts = [fffData[i:i + segment] for i in range(0, len(fffData), segment)]
+    out = [b'\xff\xd8']
+    for n, part in enumerate(parts):
+        payload = b'FLIR\0\x01' + bytes([n, len(parts) - 1]) + part
+        out.append(b'\xff\xe1' + struct.pack('>H', len(payload) + 2) + payload)
+    out.append(b'\xff\xda\x00\x02\xff\xd9')
+    return b''.join(out)
+
+# State of one simulated camera, shared by its telnet and FTP servers
+class Camera(object):
+    def __init__(self, latency=None, failures=None, seed=None):
+        self.latency = dict(LATENCY, **(latency or {}))
+        self.failures = dict(FAILURES, **(failures or {}))
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.files = {}
+        self.resources = dict(RESOURCES)
+        self.commands = 0
+
+    def fails(self, kind):
+        p = self.failures[kind]
+        return p > 0 and self.random.random() < p
+
+    # Run one shell command, returns the reply text or None to drop the connection
+    def execute(self, line):
+        self.commands += 1
+        time.sleep(self.latency['command'])
+        if self.fails('drop'):
+            return None
+        words = line.split()
+        if not words:
+            return ''
+        cmd, args = words[0], words[1:]
+        if self.fails('error'):
+            return 'Error: simulated failure'
+        if cmd == 'rset' and len(args) >= 2:
+            if args[0] not in self.resources:
+                return 'Error: resource ' + args[0] + ' not found'
+            if args[0].startswith('.system.focus.'):
+                time.sleep(self.latency['focus'])
+            else:
+                self.resources[args[0]] = ' '.join(args[1:])
+            return ''
+        if cmd == 'rget' and args:
+            value = self.resources.get(args[0])
+            return 'Error: resource ' + args[0] + ' not found' if value is None else value
+        if cmd == 'store' and args:
+            jpg = args[0] == '-j'
+            name = args[-1]
+            time.sleep(self.latency['storeJpg' if jpg else 'store'])
+            params = self.objectParams()
+            data = makeFFF(params=params, rng=self.random)
+            if jpg:
+                data = makeJPEG(data)
+            with self.lock:
+                self.files[name] = (data, time.time())
+            return ''
+        if cmd == 'del' and args:
+            with self.lock:
+                if self.files.pop(args[0], None) is None:
+                    return 'Error: file ' + args[0] + ' not found'
+            return ''
+        return 'Unknown command: ' + cmd
+
+    # Object parameters of the shell, in the units of the camera info record
+    def objectParams(self):
+        p = '.image.sysimg.basicImgData.objectParams.'
+        try:
+            return {
+                'relativeHumidity': float(self.resources[p + 'relHum']),
+                'objectDistance': float(self.resources[p + 'objectDistance']),
+                'reflectedTemp': float(self.resources[p + 'ambTemp']),
+                'atmosphericTemp': float(self.resources[p + 'atmTemp']),
+                'emissivity': float(self.resources[p + 'emissivity']),
+            }
+        except ValueError:
+            return None
+
+class TelnetHandler(socketserver.StreamRequestHandler):
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        cam = self.server.camera
+        self.wfile.write(b'\r\nWelcome to the FLIR A320 simulator [msc]\r\n\\>')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            line = line.decode('ascii', 'replace').strip()
+            if line == 'exit':
+                return
+            if line in ('date', 'time'):
+                prompt = b'Enter new date (mm/dd/yyyy): ' if line == 'date' else b'Enter new time: '
+                self.wfile.write(prompt)
+                if not self.rfile.readline():
+                    return
+                self.wfile.write(b'\\>')
+                continue
+            reply = cam.execute(line)
+            if reply is None:
+                return
+            self.wfile.write((reply + '\r\n' if reply else '').encode('ascii') + b'\\>')
+
+class FTPHandler(socketserver.StreamRequestHandler):
+    disable_nagle_algorithm = True
+
+    def reply(self, text):
+        self.wfile.write(text.encode('latin-1') + b'\r\n')
+
+    def handle(self):
+        cam = self.server.camera
+        self.passive = None
+        self.rest = 0
+        self.reply('220 FLIR A320 simulator FTP server')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            cmd, _, arg = line.decode('latin-1').strip().partition(' ')
+            cmd = cmd.upper()
+            handler = getattr(self, 'ftp_' + cmd, None)
+            if handler is None:
+                self.reply('502 Command not implemented')
+            elif handler(cam, arg) is False:
+                break
+        if self.passive is not None:
+            self.passive.close()
+
+    def ftp_USER(self, cam, arg):
+        self.reply('331 Password required')
+
+    def ftp_PASS(self, cam, arg):
+        time.sleep(cam.latency['ftpLogin'])
+        self.reply('230 Logged in')
+
+    def ftp_CWD(self, cam, arg):
+        self.reply('250 OK')
+
+    def ftp_PWD(self, cam, arg):
+        self.reply('257 "/"')
+
+    def ftp_TYPE(self, cam, arg):
+        self.reply('200 Type set')
+
+    def ftp_NOOP(self, cam, arg):
+        self.reply('200 OK')
+
+    def ftp_QUIT(self, cam, arg):
+        self.reply('221 Bye')
+        return False
+
+    def ftp_PASV(self, cam, arg):
+        if self.passive is not None:
+            self.passive.close()
+        self.passive = socket.socket()
+        self.passive.bind((self.server.server_address[0], 0))
+        self.passive.listen(1)
+        host, port = self.passive.getsockname()
+        self.reply('227 Entering Passive Mode (%s,%d,%d)' % (host.replace('.', ','), port >> 8, port & 0xff))
+
+    def ftp_SIZE(self, cam, arg):
+        entry = cam.files.get(arg)
+        self.reply('550 No such file' if entry is None else '213 %d' % len(entry[0]))
+
+    def ftp_MDTM(self, cam, arg):
+        entry = cam.files.get(arg)
+        if entry is None:
+            self.reply('550 No such file')
+        else:
+            stamp = datetime.datetime.utcfromtimestamp(entry[1])
+            self.reply('213 ' + stamp.strftime('%Y%m%d%H%M%S') + '.%03d' % (stamp.microsecond // 1000))
+
+    def ftp_REST(self, cam, arg):
+        self.rest = int(arg)
+        self.reply('350 Restarting at ' + arg)
+
+    def ftp_DELE(self, cam, arg):
+        with cam.lock:
+            found = cam.files.pop(arg, None) is not None
+        self.reply('250 Deleted' if found else '550 No such file')
+
+    # Send data over the passive connection
+    def transfer(self, cam, data, abort=False):
+        if self.passive is None:
+            self.reply('425 Use PASV first')
+            return
+        self.reply('150 Opening data connection')
+        conn, _ = self.passive.accept()
+        self.passive.close()
+        self.passive = None
+        try:
+            if abort:
+                conn.sendall(data[:len(data) // 2])
+                conn.close()
+                self.reply('426 Transfer aborted')
+                return
+            rate = cam.latency['bandwidth']
+            if rate:
+                for i in range(0, len(data), 65536):
+                    conn.sendall(data[i:i + 65536])
+                    time.sleep(len(data[i:i + 65536]) / float(rate))
+            else:
+                conn.sendall(data)
+        finally:
+            conn.close()
+        self.reply('226 Transfer complete')
+
+    def ftp_RETR(self, cam, arg):
+        entry = cam.files.get(arg)
+        if entry is None:
+            self.reply('550 No such file')
+            return
+        data = entry[0][self.rest:]
+        self.rest = 0
+        self.transfer(cam, data, cam.fails('ftpDrop'))
+
+    def ftp_NLST(self, cam, arg):
+        self.transfer(cam, ''.join(name + '\r\n' for name in sorted(cam.files)).encode('latin-1'))
+
+    def ftp_LIST(self, cam, arg):
+        lines = []
+        for name, (data, stamp) in sorted(cam.files.items()):
+            when = datetime.datetime.fromtimestamp(stamp).strftime('%b %d %H:%M')
+            lines.append('-rw-r--r-- 1 flir flir %d %s %s\r\n' % (len(data), when, name))
+        self.transfer(cam, ''.join(lines).encode('latin-1'))
+
+class Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, handler, camera):
+        self.camera = camera
+        self.connections = set()
+        socketserver.ThreadingTCPServer.__init__(self, address, handler)
+
+    def process_request(self, request, client_address):
+        self.connections.add(request)
+        socketserver.ThreadingTCPServer.process_request(self, request, client_address)
+
+    def shutdown_request(self, request):
+        self.connections.discard(request)
+        socketserver.ThreadingTCPServer.shutdown_request(self, request)
+
+    # Break all open connections, as a camera that reboots or loses the network
+    def disconnect(self):
+        for request in list(self.connections):
+            try:
+                request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+class Simulator(object):
+    # Ports 0 pick free ports, see telnetPort/ftpPort after start()
+    def __init__(self, host='127.0.0.1', telnetPort=0, ftpPort=0, latency=None, failures=None, seed=None):
+        self.host = host
+        self.state = Camera(latency, failures, seed)
+        self.servers = [Server((host, telnetPort), TelnetHandler, self.state),
+                        Server((host, ftpPort), FTPHandler, self.state)]
+        self.telnetPort = self.servers[0].server_address[1]
+        self.ftpPort = self.servers[1].server_address[1]
+
+    def start(self):
+        for server in self.servers:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+            server.disconnect()
+
+    # Drop the open telnet and FTP connections, the servers keep running
+    def disconnect(self):
+        for server in self.servers:
+            server.disconnect()
+
+    # FLIR instance for this simulator, connected unless connect is False
+    def camera(self, connect=True):
+        from functions.flir import FLIR
+        cam = FLIR(self.host, self.telnetPort, self.ftpPort)
+        if connect:
+            cam.connect()
+        return cam
+
+    # AsyncFLIR instance for this simulator, not connected yet
+    def asyncCamera(self):
+        from functions.asyncflir import AsyncFLIR
+        return AsyncFLIR(self.host, self.telnetPort, self.ftpPort)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulated FLIR A320 (telnet and FTP)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--telnet-port', type=int, default=2323)
+    parser.add_argument('--ftp-port', type=int, default=2121)
+    parser.add_argument('--store', type=float, default=LATENCY['store'], help="store latency [s]")
+    parser.add_argument('--drop', type=float, default=0.0, help="probability to drop the telnet connection per command")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)8s %(module)15s: %(message)s')
+    sim = Simulator(args.host, args.telnet_port, args.ftp_port,
+                    latency={'store': args.store, 'storeJpg': args.store}, failures={'drop': args.drop})
+    sim.start()
+    log.info("Simulator on %s, telnet port %d, FTP port %d" % (args.host, sim.telnetPort, sim.ftpPort))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        sim.stop()
@@ -0,0 +1,152 @@
+# Keeps a FLIR connection alive during unattended runs. Every call goes through
+# the supervisor; when the link breaks, the camera is marked offline and
+# reconnected with exponential backoff plus jitter (so that several clients do
+# not hammer a camera that is booting), then the clock and the object
+# parameters set so far are restored. While the camera is offline, calls fail
+# at once instead of waiting for timeouts, and the lost captures are counted.
+#
+#   sup = Supervisor(FLIR('192.168.1.10'))
+#   sup.connect()
+#   sup.call('applyParams', rh=0.5, emiss=0.95)
+#   sup.call('capture', 'jpg', sink)    # FLIRError while the camera is offline
+#   sup.tick()                          # regularly: probe or reconnect
+
+import ftplib, random, socket, time
+
+from functions.flir import FLIRError
+from functions.resources import RESOURCES
+
+import logging
+log = logging.getLogger('root')
+
+# Errors that mean the connection is gone, as opposed to a rejected command.
+# Errors of the sink of a capture arrive as SinkError and are not among them
+LINK_ERRORS = (socket.error, EOFError, ftplib.error_temp, ftplib.error_reply, ftplib.error_proto)
+
+# Setters of FLIR and the resource they set
+SETTERS = dict((r.setter, name) for name, r in RESOURCES.items() if r.setter)
+
+class Supervisor(object):
+    # probeInterval: idle time [s] after which the link is probed.
+    # backoff: first and longest delay [s] between reconnect attempts
+    def __init__(self, cam, probeInterval=10, backoff=(1, 60), jitter=0.5, clock=time.monotonic):
+        self.cam = cam
+        self.probeInterval = probeInterval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.clock = clock
+        self.online = False
+        self.params = {}         # object parameters to restore after a reconnect
+        self.attempts = 0        # failed reconnects since the link went down
+        self.retryAt = 0
+        self.lastUsed = 0
+        self.downSince = None
+        self.outages = []        # (duration [s], calls lost) of every outage so far
+        self.lost = {}           # calls refused or failed per name during the current outage
+        self.onChange = None     # onChange(online, message) after every change of state
+
+    def connect(self):
+        self.cam.connect()
+        self.cam.setDateTime()
+        if self.params:
+            self.cam.applyParams(**self.params)
+        self.online = True
+        self.attempts = 0
+        self.lastUsed = self.clock()
+
+    # Run a FLIR method. Raises FLIRError at once if the camera is offline
+    def call(self, name, *args, **kwargs):
+        if not self.online:
+            self.lost[name] = self.lost.get(name, 0) + 1
+            raise FLIRError("camera offline, next reconnect in %.0f s" % max(self.retryAt - self.clock(), 0))
+        try:
+            result = getattr(self.cam, name)(*args, **kwargs)
+        except LINK_ERRORS as e:
+            # FLIRTimeout is a socket.timeout: the shell is not answering
+            self.lost[name] = self.lost.get(name, 0) + 1
+            self.down(name + ": " + (str(e) or type(e).__name__))
+            raise
+        self.lastUsed = self.clock()
+        if name in SETTERS and args:
+            self.params[SETTERS[name]] = args[0]
+        elif name == 'set' and RESOURCES[args[0]].cached:
+            self.params[args[0]] = args[1]
+        elif name == 'applyParams':
+            self.params.update((n, kwargs[n]) for n, error in result.items() if error is None)
+        return result
+
+    def down(self, reason):
+        if not self.online:
+            return
+        log.warning("Camera connection lost (" + reason + "), reconnecting")
+        self.online = False
+        self.downSince = self.clock()
+        self.attempts = 0
+        self.retryAt = self.downSince
+        self.drop()
+        self.notify(reason)
+
+    # Close what is left of the sessions without waiting for the camera
+    def drop(self):
+        cam = self.cam
+        if cam.ftp is not None:
+            cam.ftp.close()
+            cam.ftp = None
+        if cam.tn is not None:
+            cam.tn.close()
+            cam.tn = None
+
+    # Delay before the next reconnect: doubles with every failure up to the
+    # maximum, minus a random part so that clients do not retry in step
+    def delay(self):
+        first, longest = self.backoff
+        return min(first * 2 ** self.attempts, longest) * (1 - self.jitter * random.random())
+
+    # Call regularly, e.g. every second. Probes an idle link, or tries to
+    # reconnect when the backoff delay has passed. Returns True if online
+    def tick(self):
+        now = self.clock()
+        if self.online:
+            if now - self.lastUsed >= self.probeInterval:
+                self.probe()
+            return self.online
+        if now < self.retryAt:
+            return False
+        if self.downSince is None:
+            self.downSince = now
+        try:
+            self.connect()
+        except (FLIRError,) + LINK_ERRORS as e:
+            self.drop()
+            self.retryAt = self.clock() + self.delay()
+            self.attempts += 1
+            log.info("Reconnect %d failed (%s), next in %.1f s" % (self.attempts, e, self.retryAt - self.clock()))
+            return False
+        outage = self.clock() - self.downSince
+        lost = sum(self.lost.values())
+        self.outages.append((outage, lost))
+        log.info("Camera reconnected after %.1f s, %d call(s) lost" % (outage, lost))
+        self.lost = {}
+        self.notify("reconnected after %.1f s, %d call(s) lost" % (outage, lost))
+        return True
+
+    # An empty command only brings back the prompt, the cheapest round trip the
+    # shell has. The FTP session is kept alive at the same time
+    def probe(self):
+        try:
+            self.cam.command(b'')
+            self.cam.keepalive()
+        except LINK_ERRORS as e:
+            self.down("probe: " + (str(e) or type(e).__name__))
+            return False
+        self.lastUsed = self.clock()
+        return True
+
+    def notify(self, message):
+        if self.onChange is not None:
+            self.onChange(self.online, message)
+
+    def close(self):
+        self.online = False
+        if self.cam.tn is not None:
+            self.cam.close()
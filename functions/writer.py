@@ -0,0 +1,143 @@
+# Write-behind sink: the capture thread only puts the frame into a bounded
+# queue, a background thread writes it. A slow disk therefore never delays a
+# shot. The files are forced to disk in batches (one fsync pass every
+# syncEvery files or syncInterval seconds) instead of once per file, and spread
+# over one folder per date and hour, so no folder grows without limit:
+#
+#   path/20170903/12/file-20170903-120000-250-000042.jpg
+#
+# The name holds the capture time to the millisecond and a sequence number,
+# see functions.flir.frameName.
+#
+#   sink = WriteBehindSink('logs')
+#   cam.capture('jpg', sink)     # returns at once, meta['stored'] is the file name
+#   sink.close()                 # writes what is queued and syncs
+
+import itertools, os, queue, threading, time
+
+from functions.flir import frameName
+
+import logging
+log = logging.getLogger('root')
+
+# Queue item that asks the writer thread to sync now
+SYNC = 'sync'
+
+class WriteBehindSink(object):
+    # maxQueue frames can wait to be written. When the queue is full, new frames
+    # are dropped and counted, unless block is set: then the capture waits
+    def __init__(self, path, maxQueue=64, syncEvery=16, syncInterval=5.0, partition='%Y%m%d/%H', block=False):
+        self.path = path
+        self.partition = partition
+        self.syncEvery = syncEvery
+        self.syncInterval = syncInterval
+        self.block = block
+        self.queue = queue.Queue(maxQueue)
+        self.sequence = itertools.count()
+        self.folders = set()
+        self.unsynced = []
+        self.newFolders = set() # parents of folders created since the last sync
+        self.lastSync = time.monotonic()
+        self.closed = False
+        self.stats = {'queued': 0, 'written': 0, 'bytes': 0, 'dropped': 0, 'failed': 0, 'syncs': 0, 'maxDepth': 0}
+        self.thread = threading.Thread(target=self.run, name='WriteBehindSink', daemon=True)
+        self.thread.start()
+
+    def filename(self, meta):
+        folder = os.path.join(self.path, meta['time'].strftime(self.partition)) if self.partition else self.path
+        return os.path.join(folder, frameName(meta, next(self.sequence)))
+
+    # Called on the capture thread. Returns the name the frame will be written to,
+    # or None if it was dropped because the queue is full
+    def __call__(self, data, meta):
+        filename = self.filename(meta)
+        if self.closed:
+            self.stats['dropped'] += 1
+            log.error("Writer closed, frame " + filename + " dropped")
+            return None
+        try:
+            self.queue.put((filename, data), self.block)
+        except queue.Full:
+            self.stats['dropped'] += 1
+            log.error("Write queue full, frame " + filename + " dropped")
+            return None
+        self.stats['queued'] += 1
+        self.stats['maxDepth'] = max(self.stats['maxDepth'], self.queue.qsize())
+        return filename
+
+    def run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=self.syncInterval)
+            except queue.Empty:
+                self.sync()
+                continue
+            try:
+                if item is None or item is SYNC:
+                    self.sync()
+                else:
+                    self.write(*item)
+                    if len(self.unsynced) >= self.syncEvery or time.monotonic() - self.lastSync >= self.syncInterval:
+                        self.sync()
+            finally:
+                self.queue.task_done()
+            if item is None:
+                return
+
+    def write(self, filename, data):
+        folder = os.path.dirname(filename)
+        try:
+            if folder not in self.folders:
+                os.makedirs(folder, exist_ok=True)
+                self.folders.add(folder)
+                # The entries of new folders live in their parents
+                parent = folder
+                while os.path.normpath(parent) != os.path.normpath(self.path) and os.path.dirname(parent) != parent:
+                    parent = os.path.dirname(parent)
+                    self.newFolders.add(parent)
+            with open(filename, 'wb') as f:
+                f.write(data)
+        except OSError as e:
+            self.stats['failed'] += 1
+            log.error("Writing " + filename + " failed: " + str(e))
+            return
+        self.unsynced.append(filename)
+        self.stats['written'] += 1
+        self.stats['bytes'] += len(data)
+
+    # Force the files written since the last sync, and their folders, to disk
+    def sync(self):
+        if not self.unsynced:
+            return
+        folders = self.newFolders
+        for filename in self.unsynced:
+            folders.add(os.path.dirname(filename))
+            self.fsync(filename)
+        if hasattr(os, 'O_DIRECTORY'): # folders can only be synced like this on POSIX
+            for folder in folders:
+                self.fsync(folder, os.O_DIRECTORY)
+        self.unsynced = []
+        self.newFolders = set()
+        self.lastSync = time.monotonic()
+        self.stats['syncs'] += 1
+
+    def fsync(self, path, flags=0):
+        try:
+            fd = os.open(path, os.O_RDONLY | flags)
+        except OSError as e:
+            log.error("Syncing " + path + " failed: " + str(e))
+            return
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    # Wait until everything queued so far is written and synced
+    def flush(self):
+        self.queue.put(SYNC, True)
+        self.queue.join()
+
+    def close(self):
+        self.closed = True
+        self.queue.put(None, True)
+        self.thread.join()
@@ -10,7 +10,7 @@
 #-------------------------------------------------------------------------------
 
 # System stuff
-import datetime, ctypes
+import datetime, ctypes, collections
 from time import strftime # For logging
 from os.path import expanduser # for user directory
 import os.path
@@ -22,8 +22,10 @@ from PyQt5.QtWidgets import *
 
 # Import the user interface
 from Interface import *
-import functions.flir
-flir = functions.flir.FLIR
+from functions.camworker import CameraWorker
+from functions.scheduler import DeadlineScheduler
+from functions.preview import PreviewWorker, PreviewCache
+from functions.writer import WriteBehindSink
 
 # Logging
 import logging
@@ -36,26 +38,70 @@ formatter = logging.Formatter('[%(asctime)s] %(levelname)8s %(module)15s: %(mess
 stream.setFormatter(formatter)
 log.addHandler(stream)
 
+# While logging, frames that changed by less than this against the last
+# stored frame are not stored, except every CHANGE_KEEP_EVERY-th one.
+# None stores every frame. The threshold is in °C for radiometric frames;
+# JPEG files without temperature data are compared in grey levels (0-255)
+# against CHANGE_JPEG_THRESHOLD instead
+CHANGE_THRESHOLD = None
+CHANGE_JPEG_THRESHOLD = 8.0
+CHANGE_KEEP_EVERY = 10
+
 class Main(QMainWindow, Ui_Dialog):
+    # Commands for the camera thread: FLIR method name, arguments
+    request = QtCore.pyqtSignal(str, object)
+
     def __init__(self, parent=None):
         QMainWindow.__init__(self)
         self.ui = Ui_Dialog()
         self.ui.setupUi(self)
         log.info("Starting FLIR program")
-        self.cam = None
         self.currentImg = None
         self.logFolder = ''
+        # Number of commands per name sent to the camera thread that have not finished yet
+        self.pending = collections.Counter()
+        # Shots of the logging run that failed, e.g. while the camera was offline
+        self.lostShots = 0
+        # Drops unchanged frames while logging, see CHANGE_THRESHOLD
+        self.gate = None
+        # Writes the frames of the log folder in the background, into one
+        # folder per date and hour
+        self.writer = None
 		
         # initialise the data list: 1x Date, 2x Arduino, 4x 6262
         #self.data = [float('nan')]*7
         # These threads run in the background
         self.initUI()
+        # All camera I/O happens in this thread, the results come back as signals
+        self.camThread = QtCore.QThread()
+        self.worker = CameraWorker()
+        self.worker.moveToThread(self.camThread)
+        self.request.connect(self.worker.run)
+        self.worker.finished.connect(self.cameraFinished)
+        self.worker.failed.connect(self.cameraFailed)
+        self.worker.connection.connect(self.connectionChanged)
+        self.camThread.start()
+        # JPEG decoding and scaling for the preview happen in another thread.
+        # The last previews are cached, Left/Right step through them
+        self.shots = 0
+        self.shown = None
+        self.previews = PreviewCache(20)
+        self.previewThread = QtCore.QThread()
+        self.preview = PreviewWorker(640, 480)
+        self.preview.moveToThread(self.previewThread)
+        self.preview.ready.connect(self.previewReady)
+        self.previewThread.start()
+        QShortcut(QtGui.QKeySequence(QtCore.Qt.Key_Left), self).activated.connect(lambda: self.scrub(-1))
+        QShortcut(QtGui.QKeySequence(QtCore.Qt.Key_Right), self).activated.connect(lambda: self.scrub(1))
         
         self.flir_running = False
         self.logging_running = False
 		
-        # set up timer
+        # set up timer. It is re-armed for the next deadline of the scheduler after
+        # every shot, so that slow shots don't make the interval drift
+        self.scheduler = None
         self.timer = QtCore.QTimer()
+        self.timer.setSingleShot(True)
         self.timer.timeout.connect(self.timed_tasks)
 
     def initUI(self):
@@ -77,104 +123,163 @@ class Main(QMainWindow, Ui_Dialog):
         #self.ui.IntervalTime.setText("240")
 
     def timed_tasks(self):
-        self.shootNow()
+        # Don't pile up shots if the camera is slower than the interval
+        busy = self.pending['capture'] > 0
+        slot = self.scheduler.due(busy=busy)
+        if busy:
+            log.info("Previous shot still running, skipping this one")
+        elif slot is not None:
+            if slot['missed']:
+                log.warning(str(slot['missed']) + " shot(s) missed")
+            self.shootNow()
+        self.timer.start(int(self.scheduler.delay()*1000))
+
+    # Read the interval [s] from its text field, or warn if it isn't valid
+    def interval(self):
+        interval = self.number(self.ui.IntervalTime)
+        if interval is not None and interval <= 0:
+            QMessageBox.warning(None,"Invalid value","The interval must be positive.")
+            return None
+        return interval
+
+    # Queue a command for the camera thread
+    def send(self, name, *args):
+        self.pending[name] += 1
+        self.request.emit(name, args)
+
+    # Results from the camera thread
+    def cameraFinished(self, name, result):
+        self.pending[name] -= 1
+        if name == 'connect':
+            self.ui.connect.setText("Disconnect")
+            self.flir_running = True
+            log.info("Camera ready")
+        elif name == 'capture':
+            data, meta = result
+            if meta['stored'] is None:
+                if meta.get('kept') is False:
+                    log.info("Frame unchanged (%.2f), not stored" % meta['change'])
+                return
+            # Now show the resulting image, straight from memory
+            self.currentImg = meta['stored']
+            log.info("Created file " + self.currentImg)
+            self.shots += 1
+            self.preview.submit(self.shots, data, meta)
+
+    # The camera thread lost the connection or got it back on its own
+    def connectionChanged(self, online, message):
+        if online:
+            log.info("Camera back online: " + message)
+            self.ui.connect.setText("Disconnect")
+        else:
+            log.warning("Camera offline: " + message)
+            self.ui.connect.setText("Disconnect (offline)")
+
+    # A decoded and scaled preview arrived from the preview thread
+    def previewReady(self, key, meta, image):
+        self.previews.put(key, (QtGui.QPixmap.fromImage(image), meta))
+        # Only jump to the new frame if the operator isn't looking at an older one
+        if self.shown is None or self.shown == self.previews.neighbour(key, -1):
+            self.showPreview(key)
+
+    def showPreview(self, key):
+        pixmap, meta = self.previews.get(key)
+        self.shown = key
+        self.ui.currentImg.setPixmap(pixmap)
+        self.ui.currentImg.setToolTip(meta.get('stored') or '')
+
+    # Step through the cached previews, -1: older, 1: newer
+    def scrub(self, step):
+        key = self.previews.neighbour(self.shown, step)
+        if key is not None:
+            self.showPreview(key)
+
+    def cameraFailed(self, name, message):
+        self.pending[name] -= 1
+        if name == 'connect' or not self.flir_running:
+            QMessageBox.warning(None,"Connect","Please connect the camera.")
+        elif self.logging_running:
+            # Don't block unattended logging with a dialog
+            log.warning(name + " failed: " + message)
+            if name == 'capture':
+                self.lostShots += 1
+        else:
+            QMessageBox.warning(None,"Camera",name + " failed: " + message)
+
+    # Read a number from a text field, or warn if it isn't one
+    def number(self, field):
+        try:
+            return float(field.text())
+        except ValueError:
+            QMessageBox.warning(None,"Invalid value","Please enter a number.")
+            return None
 
     def connectFLIR(self):
         if(self.flir_running == True):
             log.info("Disconnecting FLIR")
-            self.cam.close()
-            del self.cam
+            self.send('close')
             self.ui.connect.setText("Connect")
             self.flir_running = False
         else:
             log.info("Connecting FLIR " + self.ui.flirIP.text())
-            self.cam = flir(self.ui.flirIP.text())
-            try:
-                self.cam.connect()
-            except:
-                pass
-            else:
-                log.info("Setting camera date & time")
-                self.cam.setDateTime()
-                self.ui.connect.setText("Disconnect")
-                self.flir_running = True
-                log.info("Camera ready")
+            log.info("Setting camera date & time")
+            self.send('connect', self.ui.flirIP.text())
 
     def autofocusFull(self):
         log.info("Full autofocus")
-        try:
-            self.cam.slowFocus()
-        except:
-            QMessageBox.warning(None,"Connect","Please connect the camera.")
+        self.send('slowFocus')
 
     def autofocusQuick(self):
         log.info("Quick autofocus")
-        try:
-            self.cam.quickFocus()
-        except:
-            QMessageBox.warning(None,"Connect","Please connect the camera.")
+        self.send('quickFocus')
 
     def shootNow(self):
         log.info("shoot to " + self.logFolder)
-        folder = ''
-        if(self.logFolder == ''):
-            folder = self.logFolder
-        else:
-            folder = self.logFolder + "/"
-        
-        try:
-            self.currentImg = self.cam.shootJPG(folder)
-        except:
-            QMessageBox.warning(None,"Connect","Please connect the camera.")
-        else:
-            # Now show the resulting image
-            log.info("Created file " + self.currentImg)
-            image = QtGui.QImage(self.currentImg)
-            image = image.scaled(640,480, aspectRatioMode=QtCore.Qt.KeepAspectRatio, transformMode=QtCore.Qt.SmoothTransformation) # To scale image for example and keep its Aspect Ration    
-            self.ui.currentImg.setPixmap(QtGui.QPixmap.fromImage(image))
+        if self.writer is None:
+            self.writer = WriteBehindSink(self.logFolder or '.')
+        sink = self.writer
+        if self.logging_running and self.gate is not None:
+            self.gate.sink = sink
+            sink = self.gate
+        self.send('capture', 'jpg', sink)
 		
     def setAtmT(self):
         log.info("set atmospheric T " + self.ui.atmT.text())
-        try:
-            self.cam.setAtmT(float(self.ui.atmT.text()))
-        except:
-            QMessageBox.warning(None,"Connect","Please connect the camera.")
+        T = self.number(self.ui.atmT)
+        if T is not None:
+            self.send('setAtmT', T)
 
     def setAmbT(self):
         log.info("set ambient T " + self.ui.ambT.text())
-        try:
-            self.cam.setAmbT(float(self.ui.ambT.text()))
-        except:
-            QMessageBox.warning(None,"Connect","Please connect the camera.")
+        T = self.number(self.ui.ambT)
+        if T is not None:
+            self.send('setAmbT', T)
 
     def setDist(self):
         log.info("set distance " + self.ui.dist.text())
-        try:
-            self.cam.setDist(float(self.ui.dist.text()))
-        except:
-            QMessageBox.warning(None,"Connect","Please connect the camera.")
+        dist = self.number(self.ui.dist)
+        if dist is not None:
+            self.send('setDist', dist)
 
     def setRH(self):
         log.info("set relative humidity " + self.ui.rh.text())
-        self.cam.setRH(float(self.ui.rh.text())/100)
-        try:
-            self.cam.setRH(float(self.ui.rh.text())/100)
-        except:
-            QMessageBox.warning(None,"Connect","Please connect the camera.")
+        rh = self.number(self.ui.rh)
+        if rh is not None:
+            self.send('setRH', rh/100)
 
     def setEmissivity(self):
         log.info("set emissivity " + self.ui.emissivity.text())
-        try:
-            self.cam.setEmiss(float(self.ui.emissivity.text()))
-        except:
-            QMessageBox.warning(None,"Connect","Please connect the camera.")
+        E = self.number(self.ui.emissivity)
+        if E is not None:
+            self.send('setEmiss', E)
 		
     def setInterval(self):
         log.info("set interval " + self.ui.IntervalTime.text())
-        try:
-            pass
-        except:
-            QMessageBox.warning(None,"Connect","Please connect the camera.")
+        interval = self.interval()
+        if interval is not None and self.logging_running:
+            # Takes effect from the next shot, logging keeps running
+            self.scheduler.setInterval(interval)
+            self.timer.start(int(self.scheduler.delay()*1000))
 		
     def folderChooser(self):
         fname = QFileDialog.getExistingDirectory(self, "Select Directory",
@@ -185,6 +290,9 @@ class Main(QMainWindow, Ui_Dialog):
         else:
             log.info("Log data to: " + fname)
             self.logFolder = fname
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
             self.ui.logfolder.setText(fname)
 
     def logStart(self):
@@ -193,23 +301,40 @@ class Main(QMainWindow, Ui_Dialog):
             self.ui.LogStart.setText("Start logging")
             self.timer.stop()
             self.logging_running = False
+            stats = self.scheduler.stats()
+            log.info("Requested interval %.1f s, achieved %s, %d shots, %d missed, %d late, %d lost" % (
+                stats['interval'], "-" if stats['achievedInterval'] is None else "%.1f s" % stats['achievedInterval'],
+                stats['fired'], stats['missed'], stats['late'], self.lostShots))
         else:
             # Check if devices are connected
             if(self.flir_running == True):
+                interval = self.interval()
+                if interval is None:
+                    return
                 # Run every X seconds
                 #self.autofocusFull() # first focus
                 self.ui.LogStart.setText("Stop logging")
-                self.timer.start(int(self.ui.IntervalTime.text())*1000)
+                self.scheduler = DeadlineScheduler(interval)
+                self.lostShots = 0
+                self.gate = None
+                if CHANGE_THRESHOLD is not None:
+                    from functions.gate import ChangeGate # needs NumPy, only loaded when used
+                    self.gate = ChangeGate(None, CHANGE_THRESHOLD, CHANGE_KEEP_EVERY, jpegThreshold=CHANGE_JPEG_THRESHOLD)
+                self.timer.start(int(self.scheduler.delay()*1000))
                 self.logging_running = True
             else:
                 QMessageBox.warning(None,"Connect","Please connect the camera.")
 			
     def closeEvent(self, event): # This is when the window is clicked to close
         log.info("Shutting down application")
-        try:
-            self.cam.close()
-        except:
-            pass
+        if self.flir_running:
+            self.send('close')
+        self.camThread.quit()
+        self.camThread.wait()
+        self.previewThread.quit()
+        self.previewThread.wait()
+        if self.writer is not None:
+            self.writer.close()
         log.info("Shutdown completed")
         log.info('------------------')
         event.accept()
@@ -218,8 +343,9 @@ class Main(QMainWindow, Ui_Dialog):
 # Show the image
 if __name__ == "__main__":
     # This tells Windows to use my icon
-    myappid = 'mycompany.myproduct.subproduct.version' # arbitrary string
-    ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(myappid)
+    if sys.platform == 'win32':
+        myappid = 'mycompany.myproduct.subproduct.version' # arbitrary string
+        ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(myappid)
 	
     app = QApplication(sys.argv)
     myapp = Main()